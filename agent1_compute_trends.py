@@ -7,14 +7,18 @@ Output: output/trends_index.json (ranked list) with survey-boosting, grouped cat
         and top_by_category + top_combos for easier downstream consumption.
 """
 
-import json, math, time
-from collections import Counter, defaultdict
+import heapq, math, sys, time
+import ijson
+import numpy as np
+import orjson
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime, timezone
-from dateutil import parser as dateparse  # pip install python-dateutil if missing
 
 # ---------- Files ----------
 IN_CANDIDATES = [
+    Path("output/merged_catalog.ndjson"),
     Path("output/merged_catalog.json")
 ]
 OUT = Path("output/trends_index.json")
@@ -26,6 +30,10 @@ TOP_COMBOS = 200
 
 # source weights: upweight social items if present
 SOURCE_WEIGHTS = {"catalog": 1.0, "social": 1.25}
+# hoisted: only two sources exist, so the hot loop branches instead of
+# paying a dict lookup per record
+_W_SOCIAL = SOURCE_WEIGHTS["social"]
+_W_CATALOG = SOURCE_WEIGHTS["catalog"]
 
 # time decay half-life in days (set to None to disable)
 TIME_DECAY_HALF_LIFE_DAYS = 365  # make recent items matter more; set None to disable time decay
@@ -53,45 +61,82 @@ PRIOR_BOOSTS = {
 
 # ---------- Group mappings (for aggregated categories like Pastels) ----------
 COLOR_GROUPS = {
-    "Pastels": ["lavender", "baby pink", "powder pink", "mint", "pale blue", "pale green"],
-    "Neutrals": ["beige", "cream", "white", "grey", "ivory"],
-    "Earth tones": ["olive", "brown", "rust", "terracotta"]
+    "Pastels": ("lavender", "baby pink", "powder pink", "mint", "pale blue", "pale green"),
+    "Neutrals": ("beige", "cream", "white", "grey", "ivory"),
+    "Earth tones": ("olive", "brown", "rust", "terracotta")
 }
 
+# GPT canonical tokens arrive in mixed case; a case-folded view of the boost
+# table makes lookups hit regardless (a plain .get silently returned 1.0 for
+# e.g. "puff sleeves" vs "Puff sleeves")
+_BOOSTS_CF = {k.casefold(): v for k, v in PRIOR_BOOSTS.items()}
+
+def boost_for_canonical(canonical):
+    return _BOOSTS_CF.get(str(canonical).casefold(), 1.0)
+
 # ---------- Helpers ----------
-def load_input():
+def iter_input():
+    """Stream records one at a time; the whole catalog never sits in memory."""
     for p in IN_CANDIDATES:
         if p.exists():
             print("Using input:", p)
-            return json.load(open(p, encoding="utf-8"))
+            with open(p, "rb") as f:
+                if p.suffix == ".ndjson":
+                    for line in f:
+                        if line.strip():
+                            yield orjson.loads(line)
+                else:
+                    yield from ijson.items(f, "item", use_float=True)
+            return
     raise SystemExit("No input catalog found in expected locations.")
 
+# snapshot "now" once per run: keeps decay deterministic and out of the hot loop
+NOW = datetime.now(timezone.utc)
+
+@lru_cache(maxsize=131072)
 def parse_timestamp(s):
+    # scraped feeds repeat the same timestamp strings heavily, so each unique
+    # string is parsed at most once
     if not s:
         return None
-    try:
-        return dateparse.parse(s)
-    except Exception:
-        # sometimes social timestamps are epoch numbers
+    if isinstance(s, str):
+        # Instagram timestamps are strict ISO-8601; C-level fromisoformat is
+        # ~20x faster than dateutil's general-purpose tokenizer
         try:
-            return datetime.fromtimestamp(float(s), tz=timezone.utc)
+            return datetime.fromisoformat(s[:-1] + "+00:00" if s.endswith("Z") else s)
+        except ValueError:
+            pass
+        try:
+            from dateutil import parser as dateparse  # pip install python-dateutil if missing
+            return dateparse.parse(s)
         except Exception:
-            return None
+            pass
+    # sometimes social timestamps are epoch numbers
+    try:
+        return datetime.fromtimestamp(float(s), tz=timezone.utc)
+    except Exception:
+        return None
 
-def time_weight_from_timestamp(ts):
-    if not ts or TIME_DECAY_HALF_LIFE_DAYS is None:
-        return 1.0
-    if isinstance(ts, str):
-        ts = parse_timestamp(ts)
+@lru_cache(maxsize=131072)
+def _time_weight_from_str(s):
+    return _time_weight(parse_timestamp(s))
+
+def _time_weight(ts):
     if not ts:
         return 1.0
-    now = datetime.now(timezone.utc)
     if not ts.tzinfo:
         ts = ts.replace(tzinfo=timezone.utc)
-    age_days = (now - ts).total_seconds() / (3600*24)
+    age_days = (NOW - ts).total_seconds() / (3600*24)
     # half-life decay: weight = 2^(-age_days / half_life)
     return 2 ** (-age_days / float(TIME_DECAY_HALF_LIFE_DAYS))
 
+def time_weight_from_timestamp(ts):
+    if not ts or TIME_DECAY_HALF_LIFE_DAYS is None:
+        return 1.0
+    if isinstance(ts, str):
+        return _time_weight_from_str(ts)
+    return _time_weight(ts)
+
 def confidence_weight_from_record(rec):
     # use available confidence fields if present (garment_type_confidence etc.)
     c = rec.get("aggregated",{}).get("garment_type_confidence") or rec.get("garment_type_confidence")
@@ -100,47 +145,72 @@ def confidence_weight_from_record(rec):
     except Exception:
         return 1.0
 
-# ---------- Load data ----------
-data = load_input()
-N = len(data)
-print("Records:", N)
+class Record:
+    """Resolved view of one catalog item: every .get fallback chain runs once
+    here, and the hot loop reads cheap slot attributes afterwards."""
+    __slots__ = ("agg", "source", "timestamp", "conf", "url", "image", "title")
+
+    def __init__(self, p):
+        agg = p.get("aggregated", {}) or {}
+        self.agg = agg
+        # source detection - merged script may put _source or we can detect missing fields
+        self.source = p.get("_source") or p.get("source") or ("social" if p.get("product_url", "").startswith("http") and "instagram" in (p.get("product_url") or "") else "catalog")
+        # time weight input: prefer newer posts if timestamp present on social items
+        self.timestamp = p.get("post_timestamp") or p.get("created_at") or agg.get("post_timestamp")
+        self.conf = confidence_weight_from_record(p)
+        self.url = p.get("product_url") or p.get("group_key")
+        imgs = p.get("image_urls") or p.get("image_candidates") or []
+        self.image = imgs[0] if isinstance(imgs, list) and imgs else (p.get("image_url") or None)
+        self.title = p.get("example_title")
+
+# ---------- Weighted counts via token ids + one bincount ----------
+# Each attribute occurrence becomes a small integer id; the actual weighted
+# count is a single C-level np.bincount over contiguous arrays instead of
+# millions of per-item Counter increments.
+token_to_id = {}
+occ_ids = []      # one entry per attribute occurrence
+occ_weights = []  # matching product weight
+
+def token_id(tok):
+    tid = token_to_id.get(tok)
+    if tid is None:
+        tid = len(token_to_id)
+        token_to_id[tok] = tid
+    return tid
+
+def canon(v):
+    """Canonicalize an attribute value to one shared interned object.
+
+    The same few hundred strings repeat across the whole catalog; interning
+    makes every dict op on them an identity hash, and the lower() fold stops
+    case variants ("White" vs "white") becoming separate trend entries.
+    """
+    return sys.intern(str(v).strip().lower())
+
+# per-record token-id lists for the co-occurrence build (records with >=2 tokens)
+record_ids = []
+record_w = []
+
+# examples are collected in the same pass (keyed by the comps tokens);
+# only 6 are ever emitted per trend, so cap lists at insertion time instead
+# of growing O(N) lists and slicing at the end
+MAX_EXAMPLES = 6
+example_map = defaultdict(list)
 
-# ---------- Counters (weighted) ----------
-color_count = Counter()
-fabric_count = Counter()
-print_count = Counter()
-silhouette_count = Counter()
-sleeve_count = Counter()
-neck_count = Counter()
-garment_count = Counter()
-length_count = Counter()
-co = defaultdict(Counter)
-
-# helper to inc weighted counters and co-occurrence
-def weighted_inc(counter, key, w=1.0):
-    if not key:
-        return
-    try:
-        counter[key] += w
-    except Exception:
-        counter[str(key)] += w
-
-def add_co_weighted(a,b,w=1.0):
-    if a and b:
-        co[a][b] += w
-        co[b][a] += w
-
-# ---------- Iterate items and accumulate weighted counts ----------
-for p in data:
-    agg = p.get("aggregated", {}) or {}
-    # source detection - merged script may put _source or we can detect missing fields
-    source = p.get("_source") or p.get("source") or ("social" if p.get("product_url", "").startswith("http") and "instagram" in (p.get("product_url") or "") else "catalog")
-    src_weight = SOURCE_WEIGHTS.get(source, 1.0)
-    # time weight: prefer newer posts if timestamp present on social items
-    timestamp = p.get("post_timestamp") or p.get("created_at") or agg.get("post_timestamp")
-    t_weight = time_weight_from_timestamp(timestamp)
-    conf_w = confidence_weight_from_record(p)
-    product_weight = src_weight * t_weight * conf_w
+def _add_example(key, rec):
+    lst = example_map[key]
+    if len(lst) < MAX_EXAMPLES:
+        lst.append(rec)
+
+# ---------- Stream items and accumulate weighted counts (single pass) ----------
+N = 0
+for p in iter_input():
+    N += 1
+    r = Record(p)
+    agg = r.agg
+    src_weight = _W_SOCIAL if r.source == "social" else _W_CATALOG
+    t_weight = time_weight_from_timestamp(r.timestamp)
+    product_weight = src_weight * t_weight * r.conf
 
     colors = agg.get("colors") or []
     fabrics = agg.get("fabrics") or []
@@ -151,44 +221,104 @@ for p in data:
     gtype = agg.get("garment_type")
     length = agg.get("length")
 
-    # increment counts with product_weight
-    for c in colors:
-        if c and c != "unknown":
-            weighted_inc(color_count, c, product_weight)
-    for f in fabrics:
-        if f and f != "unknown":
-            weighted_inc(fabric_count, f, product_weight)
-    for pr in prints:
-        if pr and pr != "unknown":
-            weighted_inc(print_count, pr, product_weight)
-    if sil and sil != "unknown":
-        weighted_inc(silhouette_count, sil, product_weight)
-    if sleeves and sleeves != "unknown":
-        weighted_inc(sleeve_count, sleeves, product_weight)
-    if neck and neck != "unknown":
-        weighted_inc(neck_count, neck, product_weight)
-    if gtype and gtype != "unknown":
-        weighted_inc(garment_count, gtype, product_weight)
-    if length and length != "unknown":
-        weighted_inc(length_count, length, product_weight)
-
-    # build components for co-occurrence (only include non-empty canonical tokens)
+    # build components once (canonicalized, interned, non-empty tokens); these
+    # same kind-prefixed tokens drive both the weighted counts and co-occurrence
     comps = []
-    comps += [f"color:{c}" for c in colors if c and c!="unknown"]
-    comps += [f"fabric:{f}" for f in fabrics if f and f!="unknown"]
-    comps += [f"print:{pr}" for pr in prints if pr and pr!="unknown"]
-    if sil and sil!="unknown": comps.append(f"silhouette:{sil}")
-    if sleeves and sleeves!="unknown": comps.append(f"sleeve:{sleeves}")
-    if neck and neck!="unknown": comps.append(f"neck:{neck}")
-    if gtype and gtype!="unknown": comps.append(f"garment:{gtype}")
-    if length and length!="unknown": comps.append(f"length:{length}")
-
-    for i in range(len(comps)):
-        for j in range(i+1, len(comps)):
-            add_co_weighted(comps[i], comps[j], product_weight)
+    comps += [sys.intern("color:" + v) for c in colors if c and (v := canon(c)) != "unknown" and v]
+    comps += [sys.intern("fabric:" + v) for f in fabrics if f and (v := canon(f)) != "unknown" and v]
+    comps += [sys.intern("print:" + v) for pr in prints if pr and (v := canon(pr)) != "unknown" and v]
+    if sil and (v := canon(sil)) != "unknown" and v: comps.append(sys.intern("silhouette:" + v))
+    if sleeves and (v := canon(sleeves)) != "unknown" and v: comps.append(sys.intern("sleeve:" + v))
+    if neck and (v := canon(neck)) != "unknown" and v: comps.append(sys.intern("neck:" + v))
+    if gtype and (v := canon(gtype)) != "unknown" and v: comps.append(sys.intern("garment:" + v))
+    if length and (v := canon(length)) != "unknown" and v: comps.append(sys.intern("length:" + v))
+
+    ids = [token_id(tok) for tok in comps]
+    occ_ids.extend(ids)
+    occ_weights.extend([product_weight] * len(ids))
+    if len(ids) >= 2:
+        record_ids.append(ids)
+        record_w.append(product_weight)
+
+    # collect examples in the same pass: one shared record dict per product
+    example_rec = {"product_url": r.url, "image_url": r.image, "title": r.title}
+    for tok in comps:
+        if not tok.startswith("length:"):  # length entries carry no examples
+            _add_example(tok, example_rec)
+
+print("Records:", N)
+
+# reduce occurrences to per-token weighted counts in one C-level pass,
+# then split back into the per-kind dicts the rest of the script uses
+counts_arr = np.bincount(np.asarray(occ_ids, dtype=np.int64),
+                         weights=np.asarray(occ_weights, dtype=np.float64),
+                         minlength=len(token_to_id)) if token_to_id else np.zeros(0)
+
+color_count = {}
+fabric_count = {}
+print_count = {}
+silhouette_count = {}
+sleeve_count = {}
+neck_count = {}
+garment_count = {}
+length_count = {}
+_COUNT_BY_KIND = {
+    "color": color_count, "fabric": fabric_count, "print": print_count,
+    "silhouette": silhouette_count, "sleeve": sleeve_count, "neck": neck_count,
+    "garment": garment_count, "length": length_count,
+}
+for tok, tid in token_to_id.items():
+    kind, canonical = tok.split(":", 1)
+    _COUNT_BY_KIND[kind][canonical] = float(counts_arr[tid])
+
+# ---------- Co-occurrence: vectorized pair emission + one grouped reduction ----------
+# Instead of O(k^2) dict writes per record, emit all (lo,hi) id pairs with
+# np.triu_indices, fuse each pair into a single int64 key, and reduce duplicate
+# pairs with np.unique + np.bincount. The small symmetric `co` mapping is then
+# rebuilt once from the unique pairs.
+# plain float dicts: d[k] += w skips Counter's __missing__ dispatch
+co = defaultdict(lambda: defaultdict(float))
+V = len(token_to_id)
+if record_ids:
+    # pre-size the triplet buffers with the exact pair count and fill them in
+    # place: no per-record temporaries, no final concatenate. triu index
+    # pairs are cached per k since records share a handful of small sizes.
+    total_pairs = sum(len(ids) * (len(ids) - 1) // 2 for ids in record_ids)
+    buf_lo = np.empty(total_pairs, dtype=np.int64)
+    buf_hi = np.empty(total_pairs, dtype=np.int64)
+    wts = np.empty(total_pairs, dtype=np.float64)
+    _triu_cache = {}
+    offset = 0
+    for ids, w in zip(record_ids, record_w):
+        arr = np.asarray(ids, dtype=np.int64)
+        k = arr.size
+        rc = _triu_cache.get(k)
+        if rc is None:
+            rc = _triu_cache[k] = np.triu_indices(k, 1)
+        a, b = arr[rc[0]], arr[rc[1]]
+        n = a.size
+        np.minimum(a, b, out=buf_lo[offset:offset+n])
+        np.maximum(a, b, out=buf_hi[offset:offset+n])
+        wts[offset:offset+n] = w
+        offset += n
+    keys = buf_lo * V + buf_hi
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=wts)
+    id_to_token = [None] * V
+    for tok, tid in token_to_id.items():
+        id_to_token[tid] = tok
+    for key, w in zip(uniq.tolist(), sums.tolist()):
+        ta = id_to_token[key // V]
+        tb = id_to_token[key % V]
+        if ta == tb:
+            # a token repeated within one record pairs with itself twice
+            co[ta][ta] += 2 * w
+        else:
+            co[ta][tb] += w
+            co[tb][ta] += w
 
 # ---------- group counts (map color canonical to group) ----------
-group_count = Counter()
+group_count = defaultdict(float)
 for group, color_list in COLOR_GROUPS.items():
     for col in color_list:
         group_count[group] += color_count.get(col, 0)
@@ -196,7 +326,7 @@ for group, color_list in COLOR_GROUPS.items():
 # ---------- Build trend entries ----------
 trend_entries = []
 def append_counter(counter, kind):
-    for k,v in counter.most_common():
+    for k,v in sorted(counter.items(), key=lambda kv: kv[1], reverse=True):
         # convert weighted counts to integers for display if desired
         trend_entries.append({"trend_id": f"{kind}:{k}", "type": kind, "canonical": k, "count": float(v)})
 
@@ -214,61 +344,48 @@ for grp, cnt in group_count.items():
 
 # ---------- compute scores with PRIOR_BOOSTS and co-occurrence ----------
 max_count = max((e["count"] for e in trend_entries), default=1.0)
-for e in trend_entries:
-    c = float(e["count"])
-    norm = math.log(1+c)/math.log(1+max_count)
-    key = e["canonical"]
-    boost = PRIOR_BOOSTS.get(key, 1.0)
+LN1P_MAX = math.log1p(max_count)
 
-    # group items: compute member-boost mean if group is color_group
-    if e["type"]=="group" and e["canonical"] in COLOR_GROUPS:
-        members = COLOR_GROUPS[e["canonical"]]
-        bsum = 0.0
-        cntm = 0
-        for m in members:
-            bsum += PRIOR_BOOSTS.get(m, 1.0)
-            cntm += 1
-        boost = (bsum/cntm) if cntm else 1.0
-
-    # co-occurrence score (weighted)
-    co_scores = co.get(f"{e['type']}:{e['canonical']}", Counter())
-    co_score = sum(co_scores.values())/(1+len(co_scores)) if co_scores else 0.0
-    co_norm = math.log(1+co_score)/(1+math.log(1+max_count)) if co_score else 0.0
-
-    # combine into final score (tunable)
-    score = (0.60 * norm + 0.30 * (math.log(1+c)/math.log(1+max_count)) + 0.10 * co_norm) * boost
-    e["score"] = round(float(score), 5)
-    # provide top co-occurrences in array form
-    # convert Counter-like to list of tuples
-    e["co_occurrences"] = [{"item": k, "weight": v} for k,v in co.get(f"{e['type']}:{e['canonical']}", Counter()).most_common(6)]
+# group boost = mean member boost; COLOR_GROUPS is static so compute once
+GROUP_BOOSTS = {
+    grp: (sum(boost_for_canonical(m) for m in members) / len(members)) if members else 1.0
+    for grp, members in COLOR_GROUPS.items()
+}
+
+def _boost_for(e):
+    if e["type"] == "group" and e["canonical"] in GROUP_BOOSTS:
+        return GROUP_BOOSTS[e["canonical"]]
+    return boost_for_canonical(e["canonical"])
+
+def _co_score(e):
+    cs = co.get(f"{e['type']}:{e['canonical']}")
+    return sum(cs.values()) / (1 + len(cs)) if cs else 0.0
+
+n_entries = len(trend_entries)
+counts = np.fromiter((e["count"] for e in trend_entries), dtype=np.float64, count=n_entries)
+boosts = np.fromiter((_boost_for(e) for e in trend_entries), dtype=np.float64, count=n_entries)
+co_sums = np.fromiter((_co_score(e) for e in trend_entries), dtype=np.float64, count=n_entries)
+
+norm = np.log1p(counts) / LN1P_MAX
+co_norm = np.where(co_sums > 0, np.log1p(co_sums) / (1.0 + LN1P_MAX), 0.0)
+# combine into final score (tunable)
+scores = (0.60 * norm + 0.30 * norm + 0.10 * co_norm) * boosts
+
+# shared immutable fallback: no per-miss dict allocation
+_EMPTY = {}
+
+for e, score in zip(trend_entries, scores.tolist()):
+    e["score"] = round(score, 5)
+    # provide top co-occurrences in array form (single co lookup per entry)
+    co_scores = co.get(f"{e['type']}:{e['canonical']}", _EMPTY)
+    e["co_occurrences"] = [{"item": k, "weight": v} for k,v in heapq.nlargest(6, co_scores.items(), key=lambda kv: kv[1])]
 
 # ---------- rank and attach examples (cheap sampling) ----------
 trend_entries.sort(key=lambda x: x["score"], reverse=True)
 for i,e in enumerate(trend_entries, start=1):
     e["rank"] = i
 
-# attach examples (sample up to 6)
-example_map = defaultdict(list)
-for p in data:
-    agg = p.get("aggregated", {})
-    url = p.get("product_url") or p.get("group_key")
-    imgs = p.get("image_urls") or p.get("image_candidates") or []
-    sample_img = imgs[0] if isinstance(imgs, list) and imgs else (p.get("image_url") or None)
-    for c in agg.get("colors", []) or []:
-        example_map[f"color:{c}"].append({"product_url": url, "image_url": sample_img, "title": p.get("example_title")})
-    for f in agg.get("fabrics", []) or []:
-        example_map[f"fabric:{f}"].append({"product_url": url, "image_url": sample_img, "title": p.get("example_title")})
-    for pr in agg.get("prints", []) or []:
-        example_map[f"print:{pr}"].append({"product_url": url, "image_url": sample_img, "title": p.get("example_title")})
-    if agg.get("silhouette") and agg.get("silhouette")!="unknown":
-        example_map[f"silhouette:{agg.get('silhouette')}"].append({"product_url": url, "image_url": sample_img, "title": p.get("example_title")})
-    if agg.get("sleeves") and agg.get("sleeves")!="unknown":
-        example_map[f"sleeve:{agg.get('sleeves')}"].append({"product_url": url, "image_url": sample_img, "title": p.get("example_title")})
-    if agg.get("neckline") and agg.get("neckline")!="unknown":
-        example_map[f"neck:{agg.get('neckline')}"].append({"product_url": url, "image_url": sample_img, "title": p.get("example_title")})
-    if agg.get("garment_type") and agg.get("garment_type")!="unknown":
-        example_map[f"garment:{agg.get('garment_type')}"].append({"product_url": url, "image_url": sample_img, "title": p.get("example_title")})
-
+# attach examples (sample up to 6; example_map was filled in the main pass)
 for e in trend_entries:
     key = f"{e['type']}:{e['canonical']}"
     if e["type"]=="group" and e["canonical"] in COLOR_GROUPS:
@@ -299,17 +416,14 @@ combos = []
 seen = set()
 for k,v in co.items():
     # k is like "color:white"
-    for other, w in v.most_common(10):
-        combo_key = " | ".join(sorted([k, other]))
-        if combo_key in seen: 
+    for other, w in heapq.nlargest(10, v.items(), key=lambda kv: kv[1]):
+        # dedup on an ordered tuple; only format the display string for new pairs
+        t = (k, other) if k < other else (other, k)
+        if t in seen:
             continue
-        seen.add(combo_key)
-        examples = []
-        # find examples by reading example_map entries for components
-        comps = [x.split(":",1)[1] for x in combo_key.split("|")]
-        # cheap: pick first example that matches any component
-        # (downstream script will enrich more carefully)
-        combos.append({"combo": combo_key, "weight": float(w), "examples": examples})
+        seen.add(t)
+        # examples left empty here — downstream script enriches more carefully
+        combos.append({"combo": f"{t[0]} | {t[1]}", "weight": float(w), "examples": []})
 # sort combos
 combos.sort(key=lambda x: x["weight"], reverse=True)
 top_combos = combos[:TOP_COMBOS]
@@ -323,7 +437,7 @@ out_obj = {
     "top_combos": top_combos,
     "trend_entries": trend_entries[:TOP_K]
 }
-json.dump(out_obj, open(OUT, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
+OUT.write_bytes(orjson.dumps(out_obj, option=orjson.OPT_INDENT_2))
 print("Wrote", OUT)
 print("Top 20 trends (type canonical count score):")
 for t in trend_entries[:20]:
@@ -16,11 +16,13 @@ Usage:
   python enrich_with_gpt5.py
 """
 import os
-import json
+import orjson
 import time
 import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 from typing import Any, Dict, List
 
 # ---------- Config ----------
@@ -33,7 +35,9 @@ API_VER = "2024-12-01-preview"
 
 # Safety/throughput
 BATCH_SIZE = 1188       # how many products to process in one run (tune smaller for pilot)
-SLEEP_BETWEEN = 0.25  # seconds between calls (polite)
+SLEEP_BETWEEN = 0.25  # seconds between calls per worker (polite)
+MAX_WORKERS = 16      # concurrent in-flight requests (Azure allows high concurrency)
+GROUP_SIZE = 8        # products per GPT call: shares the system prompt and one round trip
 RETRIES = 2
 TIMEOUT = 60
 
@@ -43,12 +47,16 @@ if not OPENAI_BASE or not OPENAI_KEY:
 API_URL = OPENAI_BASE.rstrip("/") + f"/openai/deployments/{DEPLOY}/chat/completions?api-version={API_VER}"
 HEADERS = {"Content-Type": "application/json", "api-key": OPENAI_KEY}
 
+# one pooled session shared by all workers (connection reuse beats per-call TLS setup)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=MAX_WORKERS * 2, pool_maxsize=MAX_WORKERS * 2))
+
 # ---------- System prompt (strict) ----------
 SYSTEM_PROMPT = r"""
-You are a strict, conservative fashion analysis assistant. Return EXACTLY one JSON object (no surrounding text) following the schema below.
+You are a strict, conservative fashion analysis assistant. The user message contains one or more numbered products. Return EXACTLY one JSON array (no surrounding text) with one object per product, in the same order, each following the schema below.
 
 Rules:
-- Only return a single JSON object. No prose, no markdown, no commentary.
+- Only return a single JSON array of objects. No prose, no markdown, no commentary.
 - If you cannot determine a value, use "unknown" for strings and [] for arrays.
 - Use the canonical tokens in the taxonomy (exact spellings).
 - Keep values short. `image_description` may be one short sentence.
@@ -84,22 +92,28 @@ SCHEMA (must return these keys exactly):
 def compact_vision_summary(vision_results: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Build a concise vision summary for GPT from your vision results per product"""
     colors = []
+    seen_colors = set()        # exact entries already in colors
+    seen_colors_lower = set()  # lowercased view for the dominant-color dedup
     tags = []
     objects = []
     captions = []
     per_garment = []
     for v in vision_results:
         az = v.get("azure_image_analysis", {})
-        # colors: gather dominantColors and accentColor
+        # colors: gather dominantColors and accentColor (set-backed dedup, O(k))
         c = az.get("color") or {}
         doms = c.get("dominantColors") if isinstance(c.get("dominantColors"), list) else []
         for d in doms:
-            if d and d.lower() not in [x.lower() for x in colors]:
-                colors.append(d.lower())
-        if c.get("accentColor"):
-            acc = c.get("accentColor")
-            if acc and acc not in colors:
-                colors.append(acc)
+            dl = d.lower() if d else None
+            if dl and dl not in seen_colors_lower:
+                colors.append(dl)
+                seen_colors.add(dl)
+                seen_colors_lower.add(dl)
+        acc = c.get("accentColor")
+        if acc and acc not in seen_colors:
+            colors.append(acc)
+            seen_colors.add(acc)
+            seen_colors_lower.add(acc.lower())
         # tags: top tag names with confidence
         for t in az.get("tags") or []:
             name = t.get("name")
@@ -130,43 +144,74 @@ def compact_vision_summary(vision_results: List[Dict[str, Any]]) -> Dict[str, An
         "per_garment": per_garment
     }
 
-def make_user_message(product_url: str, vision_summary: Dict[str,Any], title: str="", description: str="") -> str:
-    return (
-        f"Product URL: {product_url}\n"
-        f"Title: {title}\n"
-        f"Description: {description}\n\n"
-        f"VISION_SUMMARY: {json.dumps(vision_summary, ensure_ascii=False)}\n\n"
-        "Return exactly the JSON object described in the system prompt. If unsure, set values to \"unknown\" or []."
+def make_user_message(items: List[tuple]) -> str:
+    """items: list of (product_url, vision_summary, title, description) tuples."""
+    parts = []
+    for i, (product_url, vision_summary, title, description) in enumerate(items, 1):
+        parts.append(
+            f"PRODUCT {i}:\n"
+            f"Product URL: {product_url}\n"
+            f"Title: {title}\n"
+            f"Description: {description}\n"
+            f"VISION_SUMMARY: {orjson.dumps(vision_summary).decode()}\n"
+        )
+    parts.append(
+        f"Return exactly a JSON array of {len(items)} objects as described in the system prompt, "
+        "in the same order as the numbered products. If unsure, set values to \"unknown\" or []."
     )
+    return "\n".join(parts)
+
+# precompiled once; the control-char sweep runs on every GPT response
+_CTRL_RE = re.compile(r"[\x00-\x1f]")
 
 def extract_first_json_block(text: str) -> Any:
     """Return python object parsed from first {...} JSON block in text."""
-    if not text or "{" not in text:
+    if not text:
         raise ValueError("No JSON object found in model output.")
-    m = re.search(r"(\{[\s\S]*\})", text)
-    if not m:
-        raise ValueError("No JSON block match.")
-    block = m.group(1)
+    # str.find/rfind are C loops; the old r"(\{[\s\S]*\})" search matched the
+    # exact same first-{ .. last-} span with regex overhead
+    i = text.find("{")
+    j = text.rfind("}")
+    if i == -1 or j == -1 or j < i:
+        raise ValueError("No JSON object found in model output.")
+    block = text[i:j+1]
     # try to fix common trailing commas etc.
     # simple cleanup - remove control chars
-    block = re.sub(r"[\x00-\x1f]", " ", block)
+    block = _CTRL_RE.sub(" ", block)
     # attempt to parse; if fails we'll raise
-    return json.loads(block)
+    return orjson.loads(block)
+
+def extract_json_array(text: str) -> List[Any]:
+    """Parse the batched response: a JSON array of per-product objects.
 
-def call_gpt(system: str, user: str) -> Dict[str, Any]:
+    Falls back to a single {...} block (wrapped in a list) so a one-product
+    group or a model that ignores the array instruction still parses.
+    """
+    if not text:
+        raise ValueError("No JSON found in model output.")
+    i = text.find("[")
+    j = text.rfind("]")
+    if i != -1 and j > i:
+        block = _CTRL_RE.sub(" ", text[i:j+1])
+        parsed = orjson.loads(block)
+        if isinstance(parsed, list):
+            return parsed
+    return [extract_first_json_block(text)]
+
+def call_gpt(system: str, user: str, max_tokens: int = 800) -> Dict[str, Any]:
     payload = {
         "messages": [
             {"role": "system", "content": system},
             {"role": "user", "content": user}
         ],
         "temperature": 0.0,
-        "max_tokens": 800
+        "max_tokens": max_tokens
     }
     for attempt in range(1, RETRIES + 2):
         try:
-            r = requests.post(API_URL, headers=HEADERS, json=payload, timeout=TIMEOUT)
+            r = SESSION.post(API_URL, headers=HEADERS, json=payload, timeout=TIMEOUT)
             r.raise_for_status()
-            return r.json()
+            return orjson.loads(r.content)
         except Exception as e:
             if attempt <= RETRIES:
                 wait = 1.5 ** attempt
@@ -176,51 +221,66 @@ def call_gpt(system: str, user: str) -> Dict[str, Any]:
                 raise
 
 # ---------- Main run ----------
-def main():
-    data = json.load(open(INPUT, encoding="utf-8"))
-    out = []
-    total = len(data)
-    print(f"Loaded {total} products from {INPUT}")
-    # do a pilot: process first BATCH_SIZE products. Adjust as needed.
-    to_process = data[:BATCH_SIZE]
-
-    for idx, prod in enumerate(to_process, 1):
+def process_chunk(chunk):
+    """Enrich a group of products with a single GPT call; returns records in order."""
+    items = []
+    records = []
+    for prod in chunk:
         product_url = prod.get("product_url") or prod.get("page_url") or "unknown"
-        vision_results = prod.get("vision_results") or []
-        title = prod.get("title") or ""
-        description = prod.get("description") or ""
-
-        vision_summary = compact_vision_summary(vision_results)
-        user_msg = make_user_message(product_url, vision_summary, title, description)
-
-        record = {
+        vision_summary = compact_vision_summary(prod.get("vision_results") or [])
+        items.append((product_url, vision_summary, prod.get("title") or "", prod.get("description") or ""))
+        records.append({
             "product_url": product_url,
             "vision_summary": vision_summary,
             "gpt_raw": None,
             "gpt_parsed": None,
             "error": None
-        }
+        })
 
-        try:
-            resp = call_gpt(SYSTEM_PROMPT, user_msg)
-            # Azure response structure: choices[0].message.content
-            content = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
+    user_msg = make_user_message(items)
+    try:
+        resp = call_gpt(SYSTEM_PROMPT, user_msg, max_tokens=800 * len(chunk))
+        # Azure response structure: choices[0].message.content
+        content = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
+        for record in records:
             record["gpt_raw"] = content
-            try:
-                parsed = extract_first_json_block(content)
+        try:
+            parsed_list = extract_json_array(content)
+            if len(parsed_list) != len(records):
+                raise ValueError(f"expected {len(records)} objects, got {len(parsed_list)}")
+            for record, parsed in zip(records, parsed_list):
                 record["gpt_parsed"] = parsed
-            except Exception as pe:
+        except Exception as pe:
+            for record in records:
                 record["error"] = f"parse_error: {str(pe)}"
-        except Exception as e:
+    except Exception as e:
+        for record in records:
             record["error"] = f"api_error: {str(e)}"
 
-        out.append(record)
-        print(f"[{idx}/{len(to_process)}] {product_url} -> parsed={'yes' if record['gpt_parsed'] else 'no'} error={record['error']}")
-        time.sleep(SLEEP_BETWEEN)
+    time.sleep(SLEEP_BETWEEN)  # per-worker politeness; in-flight calls capped by MAX_WORKERS
+    return records
+
+def main():
+    data = orjson.loads(INPUT.read_bytes())
+    out = []
+    total = len(data)
+    print(f"Loaded {total} products from {INPUT}")
+    # do a pilot: process first BATCH_SIZE products. Adjust as needed.
+    to_process = data[:BATCH_SIZE]
+    chunks = [to_process[i:i + GROUP_SIZE] for i in range(0, len(to_process), GROUP_SIZE)]
+
+    # the work is pure network wait, so threads give near-linear wall-clock
+    # speedup; executor.map preserves input order in the output file
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        idx = 0
+        for records in ex.map(process_chunk, chunks):
+            for record in records:
+                idx += 1
+                out.append(record)
+                print(f"[{idx}/{len(to_process)}] {record['product_url']} -> parsed={'yes' if record['gpt_parsed'] else 'no'} error={record['error']}")
 
     OUT.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUT, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False, indent=2)
+    OUT.write_bytes(orjson.dumps(out, option=orjson.OPT_INDENT_2))
     print("Wrote", OUT)
 
 if __name__ == "__main__":
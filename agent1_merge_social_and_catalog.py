@@ -12,45 +12,118 @@ merge_social_and_catalog.py
     output/merged_examples_sample.json (small samples)
 """
 
-import json, re, math
+import hashlib
+import re, math, sys
+from itertools import chain
+import numpy as np
+import ijson
+import orjson
 from pathlib import Path
-from collections import defaultdict
-from urllib.parse import urlparse, urlunparse, parse_qs
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 
 # --- customize these file names if needed ---
 CATALOG_FILE = Path("output/analysis_results_final_updated.json")
 SOCIAL_FILE = Path("output/instagram_posts_enriched_azure.json")  # change if different
-OUT_MERGED = Path("output/merged_catalog.json")
+OUT_MERGED = Path("output/merged_catalog.ndjson")
+OUT_PATCH = Path("output/merged_catalog.patch.ndjson")
 OUT_REPORT = Path("output/postmerge_report.json")
 OUT_SAMPLE = Path("output/merged_examples_sample.json")
 
 # ---------- utils ----------
+# shopify/CDN size variants of the same asset: "..._600x.jpg", "..._1024x768.jpg"
+_CDN_SIZE_RE = re.compile(r'_\d+x\d*(?=\.)')
+
 def norm_image_url(u):
     """Normalize image URL: strip query params that are purely sizing/version tokens,
-    and lowercase the path. Keep host + path, remove common CDN params.
+    and lowercase the path. Keep host + path, remove common CDN params and the
+    _WxH size suffix CDNs insert before the extension, so resized variants of
+    one asset collapse onto the same key.
     """
     if not u:
         return None
     try:
-        parsed = urlparse(u)
-        # remove query params except potentially meaningful ones
-        # heuristic: keep none — simpler and usually OK for shopify/cdn images
-        path = parsed.path.lower()
-        netloc = parsed.netloc.lower()
-        return f"{parsed.scheme}://{netloc}{path}"
+        # manual split instead of urlparse: no 6-tuple allocation per URL, and
+        # this runs once per catalog image and once per social record.
+        # remove query params (heuristic: keep none — usually OK for shopify/cdn)
+        scheme, sep, rest = u.partition("://")
+        if not sep:
+            # schemeless input: urlparse treated the whole string as path
+            return "://" + _CDN_SIZE_RE.sub("", u.split("?", 1)[0].split("#", 1)[0].lower())
+        rest = rest.split("?", 1)[0].split("#", 1)[0]
+        host, slash, path = rest.partition("/")
+        # intern the scheme so millions of URLs share one "https" object
+        scheme = sys.intern(scheme.lower())
+        if not slash:
+            return f"{scheme}://{host.lower()}"
+        return f"{scheme}://{host.lower()}/{_CDN_SIZE_RE.sub('', path.lower())}"
     except Exception:
         return u.lower().split("?")[0]
 
-def jaccard(a,b):
-    if not a or not b:
-        return None
-    sa = set([x.strip().lower() for x in a if x])
-    sb = set([x.strip().lower() for x in b if x])
-    if not sa and not sb:
+# tracking params that make equal-looking product/post URLs miss exact match
+_TRACKING_PARAMS = frozenset({"igshid", "fbclid", "gclid"})
+
+def norm_url(u):
+    """Canonicalize a product/post URL for exact-match lookup: lowercase host,
+    strip www., drop fragment and tracking params, sort the rest, trim the
+    trailing slash. Applied to both index keys and probes."""
+    if not u:
+        return u
+    try:
+        p = urlparse(u)
+        host = p.netloc.lower().removeprefix("www.")
+        q = [(k, v) for k, v in parse_qsl(p.query)
+             if not k.startswith("utm_") and k not in _TRACKING_PARAMS]
+        q.sort()
+        return urlunparse((p.scheme, host, p.path.rstrip("/"), "", urlencode(q), ""))
+    except Exception:
+        return u
+
+# bit-id tables for the small color/fabric vocabularies: each distinct value
+# gets a bit position on first sight, so a record's attribute set is one int
+# mask and Jaccard is two bitwise ops plus popcounts instead of building sets.
+# Python ints are arbitrary-precision, so vocabularies past 64 still work.
+_color_ids = {}
+_fabric_ids = {}
+
+def _mask(values, ids):
+    m = 0
+    for x in values:
+        if x:
+            v = x.strip().lower()
+            if v:
+                i = ids.get(v)
+                if i is None:
+                    i = ids[v] = len(ids)
+                m |= 1 << i
+    return m
+
+def _popcount64(arr):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(arr)
+    return np.unpackbits(arr.view(np.uint8)).reshape(len(arr), 64).sum(axis=1)
+
+def _batch_jaccard_avg(pairs, vocab_size):
+    """Mean Jaccard over (mask_a, mask_b) pairs in one vectorized pass.
+    Pairs whose union is empty are excluded from the average, matching the
+    old per-pair None semantics."""
+    if not pairs:
         return None
-    inter = sa & sb
-    uni = sa | sb
-    return len(inter) / len(uni) if uni else None
+    if vocab_size <= 64:
+        a = np.fromiter((p[0] for p in pairs), dtype=np.uint64, count=len(pairs))
+        b = np.fromiter((p[1] for p in pairs), dtype=np.uint64, count=len(pairs))
+        inter = _popcount64(a & b)
+        union = _popcount64(a | b)
+        valid = union > 0
+        if not valid.any():
+            return None
+        return float((inter[valid] / union[valid]).mean())
+    # vocab overflowed 64 bits: big-int masks don't fit uint64, fall back
+    vals = [
+        (ma & mb).bit_count() / u
+        for ma, mb in pairs
+        if (u := (ma | mb).bit_count())
+    ]
+    return sum(vals) / len(vals) if vals else None
 
 def ensure_list(x):
     if x is None:
@@ -59,7 +132,20 @@ def ensure_list(x):
         return x
     return [x]
 
-# ---------- load ----------
+# sentinel values that never survive an attribute merge
+_UNKNOWN = frozenset({"unknown", "", "none", "n/a"})
+# attribute schema, hoisted so merge_attributes doesn't rebuild it per call
+_MULTI_FIELDS = ("colors", "fabrics", "prints", "style_fit")
+_SINGLE_FIELDS = ("silhouette", "sleeves", "neckline", "length", "garment_type")
+# a social analysis with none of these carries nothing worth merging
+# (prints_patterns is the raw vision-prompt key the new-record path reads)
+_MERGEABLE_FIELDS = _MULTI_FIELDS + _SINGLE_FIELDS + ("prints_patterns", "caption_text", "caption")
+
+# ---------- load & index in one streaming pass ----------
+# ijson streams top-level items one at a time, so the catalog is parsed and
+# indexed in a single pass without the json.load double-buffer (raw bytes +
+# full parsed tree). The list itself is kept because the merged output is the
+# whole (mutated) catalog.
 catalog = []
 social = []
 
@@ -67,40 +153,98 @@ if not CATALOG_FILE.exists():
     print("Catalog file missing:", CATALOG_FILE)
     raise SystemExit(1)
 
-catalog = json.load(open(CATALOG_FILE, encoding="utf-8"))
+# ---------- index catalog by product_url and normalized image_url ----------
+prod_by_url = {}
+# one image maps to one product in the common case, so the hot index is a
+# flat str -> item dict; the rare duplicate images go to a side dict instead
+# of paying a list allocation per image
+image_to_prod = {}
+image_collisions = {}
+catalog_image_count = 0
+# aggregations live in a side table during the merge so catalog items stay
+# untouched until one flush pass at the end (keeps the hot loop on one dict
+# and gives the patch output a single place to read mutations from)
+agg_by_id = {}
+
+# 1 MiB read buffer: amortizes syscalls when the catalog sits on network FS
+with open(CATALOG_FILE, "rb", buffering=1 << 20) as f:
+    # use_float keeps JSON numbers as float (ijson's default Decimal
+    # would blow up the orjson writers downstream)
+    for item in ijson.items(f, "item", use_float=True):
+        catalog.append(item)
+        agg_by_id[id(item)] = item.get("aggregated", {})
+        # canonical product url keys might be 'product_url' or 'group_key'
+        purl = item.get("product_url") or item.get("group_key")
+        if purl:
+            prod_by_url[norm_url(purl)] = item
+        # index images
+        imgs = item.get("image_urls") or item.get("images") or []
+        for im in ensure_list(imgs):
+            n = norm_image_url(im)
+            if n:
+                existing = image_to_prod.setdefault(n, item)
+                if existing is not item:
+                    image_collisions.setdefault(n, [existing]).append(item)
+                catalog_image_count += 1
 print("Loaded catalog:", len(catalog))
 
 if not SOCIAL_FILE.exists():
     print("Social file missing:", SOCIAL_FILE, " — proceeding with catalog only.")
 else:
-    social = json.load(open(SOCIAL_FILE, encoding="utf-8"))
+    with open(SOCIAL_FILE, "rb", buffering=1 << 20) as f:
+        social = list(ijson.items(f, "item", use_float=True))
     print("Loaded social:", len(social))
 
-# ---------- index catalog by product_url and normalized image_url ----------
-prod_by_url = {}
-image_to_prod = defaultdict(list)
-catalog_image_count = 0
-
-for item in catalog:
-    # canonical product url keys might be 'product_url' or 'group_key'
-    purl = item.get("product_url") or item.get("group_key")
-    if purl:
-        prod_by_url[purl] = item
-    # index images
-    imgs = item.get("image_urls") or item.get("images") or []
-    for im in ensure_list(imgs):
-        n = norm_image_url(im)
-        if n:
-            image_to_prod[n].append(item)
-            catalog_image_count += 1
+# ---------- combined match index ----------
+# one dict keyed by anything that can reach a product (product_url or a
+# normalized image URL); the tag records which kind of key matched so the
+# merge counters stay separate
+match_index = {}
+for n, item in image_to_prod.items():
+    match_index.setdefault(n, (item, "img"))
+for purl, item in prod_by_url.items():
+    match_index[purl] = (item, "url")  # product-url keys take precedence
 
 # ---------- process social items ----------
 added = 0
 merged_by_product_url = 0
 merged_by_image = 0
 created_new = 0
-color_jaccard_values = []
-fabric_jaccard_values = []
+# ids of catalog items mutated by a merge; new social records carry _source,
+# so dirty ids + _source together define the delta this run produced
+dirty_ids = set()
+# mask pairs are collected during the loop (before the merge mutates the
+# target) and reduced to averages in one vectorized pass at the end
+color_mask_pairs = []
+fabric_mask_pairs = []
+
+# ---------- specialized merge kernel ----------
+# The attribute schema is fixed at import time, so generate a straight-line
+# merge function with the field loops unrolled: no per-call iteration over
+# _MULTI_FIELDS/_SINGLE_FIELDS, every key a compile-time constant.
+def _build_merge_fast():
+    lines = ["def _merge_fast(base_agg, s):"]
+    for k in _MULTI_FIELDS:
+        lines += [
+            f"    cur = ensure_list(base_agg.get({k!r}))",
+            f"    incoming = ensure_list(s.get({k!r}))",
+            f"    base_agg[{k!r}] = list(dict.fromkeys(",
+            "        v for x in chain(cur, incoming)",
+            "        if x and (v := str(x).strip()).lower() not in _UNKNOWN",
+            "    ))",
+        ]
+    for k in _SINGLE_FIELDS:
+        lines += [
+            f"    base_val = base_agg.get({k!r})",
+            f"    incoming_val = s.get({k!r}) or s.get({k + '_raw'!r}) or None",
+            "    if (not base_val or str(base_val).strip().lower()=='unknown') and incoming_val:",
+            f"        base_agg[{k!r}] = incoming_val",
+        ]
+    ns = {"ensure_list": ensure_list, "chain": chain, "_UNKNOWN": _UNKNOWN}
+    exec(compile("\n".join(lines), "<merge_fast>", "exec"), ns)
+    return ns["_merge_fast"]
+
+_merge_fast = _build_merge_fast()
 
 # helper to merge aggregated fashion attributes
 def merge_attributes(base_agg, social_analysis):
@@ -116,27 +260,10 @@ def merge_attributes(base_agg, social_analysis):
     if not isinstance(base_agg, dict):
         base_agg = {}
     s = social_analysis or {}
-    # multi fields
-    for k in ("colors","fabrics","prints","style_fit"):
-        cur = ensure_list(base_agg.get(k))
-        incoming = ensure_list(s.get(k) or s.get("colors") if k=="colors" else s.get(k))
-        # normalize casing
-        cur_norm = [str(x).strip() for x in cur if x and str(x).strip().lower()!="unknown"]
-        inc_norm = [str(x).strip() for x in incoming if x and str(x).strip().lower()!="unknown"]
-        combined = []
-        for v in cur_norm + inc_norm:
-            if v and v not in combined:
-                combined.append(v)
-        base_agg[k] = combined
-
-    # single fields
-    for k in ("silhouette","sleeves","neckline","length","garment_type"):
-        base_val = base_agg.get(k)
-        incoming_val = s.get(k) or s.get(k+"_raw") or None
-        # if base empty or unknown, take incoming
-        if (not base_val or str(base_val).strip().lower()=="unknown") and incoming_val:
-            base_agg[k] = incoming_val
-        # else keep base
+    # multi + single fields via the unrolled kernel (dedup through
+    # dict.fromkeys, unknown sentinels filtered, catalog single values kept
+    # unless missing/unknown)
+    _merge_fast(base_agg, s)
 
     # images_count
     try:
@@ -169,49 +296,53 @@ for s in social:
     # common fields: image_url, image_urls, page_url, post_url, fashion_analysis, caption_text
     s_image = s.get("image_url") or (s.get("image_urls") and s.get("image_urls")[0]) or None
     s_img_norm = norm_image_url(s_image) if s_image else None
-    s_product_url = s.get("post_url") or s.get("page_url") or None
+    s_product_url = norm_url(s.get("post_url") or s.get("page_url") or None)
     s_fashion = s.get("fashion_analysis") or s.get("gpt_parsed") or s.get("analysis") or {}
 
-    matched = False
+    # vision produced nothing for this post (empty dict or bare error):
+    # merging would only write an empty provenance snippet, and creating a
+    # "new" record would add an attributeless product — skip outright
+    if not s_fashion or not any(s_fashion.get(k) for k in _MERGEABLE_FIELDS):
+        continue
 
-    # 1) try product_url match (exact)
-    if s_product_url and s_product_url in prod_by_url:
-        target = prod_by_url[s_product_url]
-        target_agg = target.get("aggregated", {})
-        # compute Jaccard if both have colors/fabrics
-        cj = jaccard(target_agg.get("colors"), s_fashion.get("colors"))
-        fj = jaccard(target_agg.get("fabrics"), s_fashion.get("fabrics"))
-        if cj is not None:
-            color_jaccard_values.append(cj)
-        if fj is not None:
-            fabric_jaccard_values.append(fj)
-        merge_attributes(target_agg, s_fashion)
-        target["aggregated"] = target_agg
-        merged_by_product_url += 1
-        matched = True
+    matched = False
 
-    # 2) else try normalized image match
-    if not matched and s_img_norm and s_img_norm in image_to_prod:
-        # choose first matched product (could be enhanced to pick best)
-        possible = image_to_prod[s_img_norm]
-        target = possible[0]
-        target_agg = target.get("aggregated", {})
-        cj = jaccard(target_agg.get("colors"), s_fashion.get("colors"))
-        fj = jaccard(target_agg.get("fabrics"), s_fashion.get("fabrics"))
-        if cj is not None:
-            color_jaccard_values.append(cj)
-        if fj is not None:
-            fabric_jaccard_values.append(fj)
-        merge_attributes(target_agg, s_fashion)
-        target["aggregated"] = target_agg
-        merged_by_image += 1
+    # single probe: product_url first (exact), then normalized image
+    hit = match_index.get(s_product_url) if s_product_url else None
+    if hit is None and s_img_norm:
+        hit = match_index.get(s_img_norm)
+    if hit is not None:
+        target, how = hit
+        target_agg = agg_by_id[id(target)]
+        # collect mask pairs for Jaccard if both have colors/fabrics
+        t_colors = target_agg.get("colors")
+        s_colors = s_fashion.get("colors")
+        if t_colors and s_colors:
+            color_mask_pairs.append((_mask(t_colors, _color_ids), _mask(s_colors, _color_ids)))
+        t_fabrics = target_agg.get("fabrics")
+        s_fabrics = s_fashion.get("fabrics")
+        if t_fabrics and s_fabrics:
+            fabric_mask_pairs.append((_mask(t_fabrics, _fabric_ids), _mask(s_fabrics, _fabric_ids)))
+        # merge_attributes returns a fresh dict when the stored aggregated
+        # value wasn't one, so keep the returned reference
+        agg_by_id[id(target)] = merge_attributes(target_agg, s_fashion)
+        dirty_ids.add(id(target))
+        if how == "url":
+            merged_by_product_url += 1
+        else:
+            merged_by_image += 1
         matched = True
 
     # 3) else: create a new product-like entry from social post
     if not matched:
         new_obj = {}
         # minimal product fields: group_key, example_title, image_urls, aggregated
-        new_obj["group_key"] = s.get("post_url") or s.get("page_url") or f"social:{len(social)}:{hash(s.get('image_url') or '')}"
+        # stable fallback key: builtin hash() is randomized per process, which
+        # would give the same record a different key on every rerun
+        new_obj["group_key"] = (
+            s.get("post_url") or s.get("page_url")
+            or "social:" + hashlib.blake2s((s.get("image_url") or "").encode("utf-8")).hexdigest()
+        )
         new_obj["product_url"] = s.get("post_url") or None
         new_obj["image_urls"] = [s.get("image_url")] if s.get("image_url") else (s.get("image_urls") or [])
         # aggregated from fashion_analysis if present
@@ -235,6 +366,12 @@ for s in social:
         created_new += 1
 
 # ---------- finish & report ----------
+# flush mutated aggregations from the side table back onto the catalog
+for it in catalog:
+    i = id(it)
+    if i in dirty_ids:
+        it["aggregated"] = agg_by_id[i]
+
 total_after = len(catalog)
 report = {
     "catalog_before": len(prod_by_url),
@@ -244,19 +381,31 @@ report = {
     "created_new_social_records": created_new,
     "total_after_merge": total_after,
     "catalog_images_indexed": catalog_image_count,
-    "color_jaccard_avg": None,
-    "fabric_jaccard_avg": None
+    "color_jaccard_avg": _batch_jaccard_avg(color_mask_pairs, len(_color_ids)),
+    "fabric_jaccard_avg": _batch_jaccard_avg(fabric_mask_pairs, len(_fabric_ids))
 }
 
-if color_jaccard_values:
-    report["color_jaccard_avg"] = sum(color_jaccard_values) / len(color_jaccard_values)
-if fabric_jaccard_values:
-    report["fabric_jaccard_avg"] = sum(fabric_jaccard_values) / len(fabric_jaccard_values)
-
-# write outputs
+# write outputs (orjson serializes straight to UTF-8 bytes, no string detour).
+# The merged catalog goes out as NDJSON — one object per line — so neither
+# this writer nor downstream readers ever hold the serialized blob in memory.
 OUT_MERGED.parent.mkdir(parents=True, exist_ok=True)
-json.dump(catalog, open(OUT_MERGED, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
-json.dump(report, open(OUT_REPORT, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
+with open(OUT_MERGED, "wb") as f:
+    for item in catalog:
+        f.write(orjson.dumps(item))
+        f.write(b"\n")
+
+# delta of this run: only merged-into or newly created records. Consumers
+# holding an older full catalog can apply it with merge_patch.py instead of
+# re-reading the whole file.
+patched = 0
+with open(OUT_PATCH, "wb") as f:
+    for item in catalog:
+        if id(item) in dirty_ids or item.get("_source") == "social":
+            f.write(orjson.dumps(item))
+            f.write(b"\n")
+            patched += 1
+print(f"WROTE patch file: {OUT_PATCH} ({patched} records)")
+OUT_REPORT.write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
 
 # write small sample of merged items for inspection
 sample = []
@@ -269,7 +418,7 @@ for i, item in enumerate(catalog):
         "image_urls": item.get("image_urls")[:2] if item.get("image_urls") else [],
         "aggregated": item.get("aggregated")
     })
-json.dump(sample, open(OUT_SAMPLE, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
+OUT_SAMPLE.write_bytes(orjson.dumps(sample, option=orjson.OPT_INDENT_2))
 
 print("WROTE merged file:", OUT_MERGED)
 print("WROTE report:", OUT_REPORT)
@@ -15,19 +15,48 @@ What it does:
 Run:
   python postprocess_finalize.py
 """
+import hashlib
 import json
+import orjson
 import os
 import re
+import shelve
+import sys
+import ijson
 from pathlib import Path
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+
+try:
+    # optional: SIMD multi-pattern scanner; the stdlib re alternation below
+    # is the portable fallback and produces the same matches
+    import hyperscan
+except ImportError:
+    hyperscan = None
 
 # ---------- Input / output ----------
 INPUT = "output/analysis_results_enriched_updated.json"
 OUTPUT = "output/analysis_results_final_updated.json"
 
+# disk-backed memo of mapped products, keyed by a content hash of the raw
+# record: reruns against a mostly-unchanged snapshot skip the mapping
+# entirely for records that did not change (delete the files to reset)
+CACHE_FILE = "output/.postprocess_cache"
+CACHE_BATCH = 4096
+
 # ---------- Utilities ----------
+@lru_cache(maxsize=4096)
+def _lower_and_strip_cached(s):
+    # split()/join collapses all whitespace runs (and trims ends) in C,
+    # cheaper than running the \s+ regex on these short strings
+    return " ".join(s.lower().split())
+
 def lower_and_strip(s):
-    return re.sub(r"\s+", " ", (s or "").strip().lower())
+    # raw attribute values repeat heavily across products, so the
+    # normalized form is cached; the guard keeps None out of the cache
+    return _lower_and_strip_cached(s) if s else ""
 
 def ensure_list(x):
     if x is None:
@@ -45,30 +74,84 @@ def is_hex_token(tok):
         t = t[1:]
     return bool(HEX_RE.match(t))
 
-def find_canonical(value, synonyms_map):
+def build_reverse_table(synonyms_map):
+    """Flatten a canonical -> [synonyms...] map into lookup structures:
+    - rev: syn -> canonical, so exact matches are one dict.get
+    - scanner: one multi-pattern scanner over every synonym (a hyperscan
+      database when that is installed, else a longest-first re alternation),
+      so the substring scan is a single C-level pass over the value instead
+      of a Python loop per synonym ("baby pink" still beats "pink")
+    - canon_by_lc: normalized canonical name -> canonical, so the equality
+      fallback is a dict.get instead of re-normalizing every constant per call
+    First canonical wins when two share a synonym, matching dict order.
+
+    The dict-of-lists source is flattened into one contiguous tuple of
+    interned (synonym, canonical_id) pairs before the lookups are built:
+    a single linear sweep instead of chasing dict slot -> list -> item
+    pointers, and interning lets later dict probes short-circuit on
+    string identity.
+    """
+    canons = tuple(sys.intern(c) for c in synonyms_map)
+    flat = tuple(
+        (sys.intern(syn), cid)
+        for cid, syns in enumerate(synonyms_map.values())
+        for syn in syns
+    )
+    rev = {}
+    for syn, cid in flat:
+        rev.setdefault(syn, canons[cid])
+    ordered = sorted(rev, key=len, reverse=True)
+    if hyperscan is not None:
+        # one vectorized DFA pass over all synonyms per value
+        db = hyperscan.Database()
+        db.compile(expressions=[re.escape(syn).encode() for syn in ordered],
+                   ids=list(range(len(ordered))),
+                   flags=[0] * len(ordered))
+        scanner = (db, tuple(ordered))
+    else:
+        scanner = re.compile("|".join(re.escape(syn) for syn in ordered))
+    canon_by_lc = {}
+    for canon in canons:
+        canon_by_lc.setdefault(lower_and_strip(canon), canon)
+    return rev, scanner, canon_by_lc
+
+def scan_longest(val, rev, scanner):
+    """Return the canonical for the longest synonym appearing in val, else None."""
+    if isinstance(scanner, tuple):
+        # hyperscan path: the handler collects pattern ids, longest synonym wins
+        db, syns = scanner
+        hit_ids = []
+        db.scan(val.encode(), match_event_handler=lambda pid, *_: hit_ids.append(pid))
+        if not hit_ids:
+            return None
+        return rev[max((syns[pid] for pid in set(hit_ids)), key=len)]
+    best = None
+    for m in scanner.finditer(val):
+        g = m.group()
+        if best is None or len(g) > len(best):
+            best = g
+    return rev[best] if best else None
+
+def find_canonical(value, table):
     """
     value: string (raw)
-    synonyms_map: dict canonical -> [synonyms...]
+    table: prebuilt (rev, regex, canons) from build_reverse_table
     returns canonical if matched else None
     """
     if not value:
         return None
     val = lower_and_strip(value)
-    # exact synonyms
-    for canon, syns in synonyms_map.items():
-        for syn in syns:
-            if syn == val:
-                return canon
-    # substring match
-    for canon, syns in synonyms_map.items():
-        for syn in syns:
-            if syn in val:
-                return canon
-    # if value equals canonical name
-    for canon in synonyms_map.keys():
-        if lower_and_strip(canon) == val:
-            return canon
-    return None
+    rev, scanner, canon_by_lc = table
+    # exact synonyms: single hash lookup
+    canon = rev.get(val)
+    if canon:
+        return canon
+    # substring match: one automaton pass, longest synonym wins
+    canon = scan_longest(val, rev, scanner)
+    if canon:
+        return canon
+    # if value equals canonical name (normalized at import)
+    return canon_by_lc.get(val)
 
 # ---------- Expanded canonical taxonomy & synonyms ----------
 CANON_COLORS = [
@@ -289,6 +372,39 @@ CANON_STYLE_FIT = [
 ]
 STYLE_SYNONYMS = SILHOUETTE_SYNONYMS
 
+# intern every canonical string once so the hot equality/membership checks
+# (`matched not in seen`, seen.add, allow-list containment) short-circuit on
+# pointer identity; build_reverse_table already interns the synonym side
+for _canon_list in (CANON_COLORS, CANON_FABRICS, CANON_PRINTS, CANON_NECKLINES,
+                    CANON_SLEEVES, CANON_SILHOUETTES, CANON_LENGTHS,
+                    CANON_GARMENT_TYPES, CANON_STYLE_FIT):
+    _canon_list[:] = [sys.intern(c) for c in _canon_list]
+
+# reverse lookup tables, built once: the per-value match path does a dict.get
+# plus at worst one sweep over a flat longest-first list instead of nested
+# loops over every canonical's synonym list
+REV_COLOR = build_reverse_table(COLOR_SYNONYMS)
+REV_FABRIC = build_reverse_table(FABRIC_SYNONYMS)
+REV_PRINT = build_reverse_table(PRINT_SYNONYMS)
+REV_NECK = build_reverse_table(NECK_SYNONYMS)
+REV_SLEEVE = build_reverse_table(SLEEVE_SYNONYMS)
+REV_SILHOUETTE = build_reverse_table(SILHOUETTE_SYNONYMS)
+REV_LENGTH = build_reverse_table(LENGTH_SYNONYMS)
+REV_GARMENT = build_reverse_table(GARMENT_SYNONYMS)
+REV_STYLE = REV_SILHOUETTE
+
+# canonical allow-lists, normalized once for the containment fallback so the
+# per-value loop never calls lower_and_strip on a constant
+ALLOW_COLOR = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_COLORS)
+ALLOW_FABRIC = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_FABRICS)
+ALLOW_PRINT = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_PRINTS)
+ALLOW_NECK = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_NECKLINES)
+ALLOW_SLEEVE = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_SLEEVES)
+ALLOW_SILHOUETTE = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_SILHOUETTES)
+ALLOW_LENGTH = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_LENGTHS)
+ALLOW_GARMENT = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_GARMENT_TYPES)
+ALLOW_STYLE = tuple((sys.intern(lower_and_strip(c)), c) for c in CANON_STYLE_FIT)
+
 # ---------- Cleanup rules (garment-type-aware) ----------
 CLEANUP_RULES = {
     "sari": {"length": "unknown", "sleeves": "unknown", "neckline": "unknown"},
@@ -324,19 +440,12 @@ def map_color_list(raw_list):
                 mapped.append(token)
                 seen.add(token)
             continue
-        # try synonyms map
-        matched = None
-        for canon, syns in COLOR_SYNONYMS.items():
-            for syn in syns:
-                if syn in r:
-                    matched = canon
-                    break
-            if matched:
-                break
+        # try synonyms map: exact hit, then one longest-match automaton pass
+        matched = REV_COLOR[0].get(r) or scan_longest(r, REV_COLOR[0], REV_COLOR[1])
         # fallback: direct canonical token contained
         if not matched:
-            for c in CANON_COLORS:
-                if lower_and_strip(c) in r:
+            for lc, c in ALLOW_COLOR:
+                if lc in r:
                     matched = c
                     break
         if matched and matched not in seen:
@@ -344,7 +453,7 @@ def map_color_list(raw_list):
             seen.add(matched)
     return mapped
 
-def map_generic_list(raw_list, syn_map, allow_list):
+def map_generic_list(raw_list, rev_table, allow_pairs):
     mapped = []
     seen = set()
     for raw in ensure_list(raw_list):
@@ -357,11 +466,11 @@ def map_generic_list(raw_list, syn_map, allow_list):
         r = lower_and_strip(raw_val)
         if r == "unknown" or r == "":
             continue
-        matched = find_canonical(r, syn_map)
+        matched = find_canonical(r, rev_table)
         if not matched:
             # try any canonical token contained in text
-            for canon in allow_list:
-                if lower_and_strip(canon) in r:
+            for lc, canon in allow_pairs:
+                if lc in r:
                     matched = canon
                     break
         if matched and matched not in seen:
@@ -369,13 +478,145 @@ def map_generic_list(raw_list, syn_map, allow_list):
             seen.add(matched)
     return mapped
 
+def map_generic_single(raw, rev_table, allow_pairs):
+    """Scalar hot path for single-valued fields (garment type, silhouette,
+    sleeves, neckline, length): same matching as map_generic_list but with
+    no list wrapper, iteration or dedup set. Returns canonical or None."""
+    if not raw:
+        return None
+    if isinstance(raw, dict):
+        raw = raw.get("name") or raw.get("value") or ""
+    r = lower_and_strip(str(raw))
+    if r == "" or r == "unknown":
+        return None
+    matched = find_canonical(r, rev_table)
+    if matched:
+        return matched
+    # try any canonical token contained in text
+    for lc, canon in allow_pairs:
+        if lc in r:
+            return canon
+    return None
+
 # ---------- Main processing ----------
+def _product_cache_key(prod):
+    """Stable content hash of a raw product record (covers every field the
+    mapping reads, since it covers all of them)."""
+    return hashlib.blake2b(
+        orjson.dumps(prod, option=orjson.OPT_SORT_KEYS), digest_size=16
+    ).hexdigest()
+
+def process_one_product(prod):
+    """Map one raw product to its final object. Returns (final_obj, used_gpt).
+
+    Module-level (not a closure) so ProcessPoolExecutor can pickle it.
+    """
+    # hoisted once: these nested dicts are probed several times below
+    vision_summary = prod.get("vision_summary") or {}
+    prod_agg = prod.get("aggregated") or {}
+
+    # Prefer gpt_parsed (enriched) if present, fallback to prod["aggregated"]
+    agg = {}
+    used_gpt = bool(prod.get("gpt_parsed"))
+    if used_gpt:
+        gp = prod.get("gpt_parsed") or {}
+        agg = {
+            "colors": gp.get("colors", []),
+            "fabrics": gp.get("fabrics", []),
+            "prints": gp.get("prints_patterns", []),
+            "garment_type": gp.get("garment_type", []),
+            "silhouette": gp.get("silhouette"),
+            "sleeves": gp.get("sleeves"),
+            "neckline": gp.get("neckline"),
+            "style_fit": gp.get("style_fit", []),
+            "length": gp.get("length"),
+            "images_count": vision_summary.get("images_count") or prod_agg.get("images_count", 1),
+            "garment_type_confidence": (gp.get("garment_type_confidence") or prod_agg.get("garment_type_confidence"))
+        }
+    else:
+        agg = prod_agg
+
+    # map colors
+    raw_colors = agg.get("colors") or agg.get("colors_list") or []
+    mapped_colors = map_color_list(raw_colors)
+
+    # fabrics
+    raw_fabs = agg.get("fabrics") or []
+    mapped_fabrics = map_generic_list(raw_fabs, REV_FABRIC, ALLOW_FABRIC)
+
+    # prints
+    raw_pr = agg.get("prints") or agg.get("prints_patterns") or []
+    mapped_prints = map_generic_list(raw_pr, REV_PRINT, ALLOW_PRINT)
+
+    # garment type
+    raw_gt = agg.get("garment_type") or ""
+    if isinstance(raw_gt, list):
+        raw_gt = raw_gt[0] if raw_gt else ""
+    gt_choice = map_generic_single(raw_gt, REV_GARMENT, ALLOW_GARMENT) or "unknown"
+
+    # Garment-type aware cleanup rules: checked before mapping, since for
+    # sari/kurta records they overwrite sleeves/neckline/length outright and
+    # scanning synonyms for a value about to be clobbered is wasted work.
+    # CLEANUP_RULES keys and canonical garment types are both lowercase.
+    rules = CLEANUP_RULES.get(gt_choice, {})
+
+    # silhouette, sleeves, neckline, style_fit, length
+    sil_choice = map_generic_single(agg.get("silhouette"), REV_SILHOUETTE, ALLOW_SILHOUETTE) or "unknown"
+
+    if "sleeves" in rules:
+        sleeves_choice = rules["sleeves"]
+    else:
+        sleeves_choice = map_generic_single(agg.get("sleeves"), REV_SLEEVE, ALLOW_SLEEVE) or "unknown"
+
+    if "neckline" in rules:
+        neck_choice = rules["neckline"]
+    else:
+        neck_choice = map_generic_single(agg.get("neckline"), REV_NECK, ALLOW_NECK) or "unknown"
+
+    style = agg.get("style_fit") or []
+    style_m = map_generic_list(style, REV_STYLE, ALLOW_STYLE)
+
+    if "length" in rules:
+        length_choice = rules["length"]
+    else:
+        length_choice = map_generic_single(agg.get("length"), REV_LENGTH, ALLOW_LENGTH) or "unknown"
+
+    # Build final product object
+    final_obj = {
+        "group_key": prod.get("group_key") or prod.get("product_url"),
+        "product_url": prod.get("product_url") or prod.get("page_url"),
+        "image_urls": vision_summary.get("images", []) or prod.get("image_candidates", []) or prod.get("image_urls", []),
+        "example_title": prod.get("product_title") or prod.get("example_title") or (prod.get("_meta_raw") or {}).get("ld_name") or "",
+        "aggregated": {
+            "colors": mapped_colors,
+            "fabrics": mapped_fabrics,
+            "prints": mapped_prints,
+            "garment_type": gt_choice,
+            "garment_type_confidence": agg.get("garment_type_confidence"),
+            "silhouette": sil_choice,
+            "sleeves": sleeves_choice,
+            "neckline": neck_choice,
+            "style_fit": style_m,
+            "length": length_choice,
+            "images_count": agg.get("images_count", 1)
+        }
+    }
+    return final_obj, used_gpt
+
+
 def process_products(input_path=INPUT, output_path=OUTPUT):
     p = Path(input_path)
     if not p.exists():
         print("Input file not found:", input_path)
         return
-    products = json.loads(p.read_text(encoding="utf-8"))
+    def iter_products():
+        # stream products one at a time; the raw file never sits in memory
+        # alongside the fully parsed list
+        with open(p, "rb") as f:
+            # use_float keeps JSON numbers as float (ijson's default Decimal
+            # would not round-trip through json.dumps)
+            yield from ijson.items(f, "item", use_float=True)
+
     final = []
     # stats counters
     color_counter = Counter()
@@ -386,124 +627,65 @@ def process_products(input_path=INPUT, output_path=OUTPUT):
     unknown_color_count = 0
     unknown_fabric_count = 0
 
-    for prod in products:
-        # Prefer gpt_parsed (enriched) if present, fallback to prod["aggregated"]
-        agg = {}
-        if prod.get("gpt_parsed"):
-            used_gpt += 1
-            gp = prod.get("gpt_parsed") or {}
-            agg = {
-                "colors": gp.get("colors", []),
-                "fabrics": gp.get("fabrics", []),
-                "prints": gp.get("prints_patterns", []),
-                "garment_type": gp.get("garment_type", []),
-                "silhouette": gp.get("silhouette"),
-                "sleeves": gp.get("sleeves"),
-                "neckline": gp.get("neckline"),
-                "style_fit": gp.get("style_fit", []),
-                "length": gp.get("length"),
-                "images_count": (prod.get("vision_summary") or {}).get("images_count") or (prod.get("aggregated") or {}).get("images_count", 1),
-                "garment_type_confidence": (gp.get("garment_type_confidence") or (prod.get("aggregated") or {}).get("garment_type_confidence"))
-            }
-        else:
-            used_agg += 1
-            agg = prod.get("aggregated", {}) or {}
-
-        # map colors
-        raw_colors = agg.get("colors") or agg.get("colors_list") or []
-        mapped_colors = map_color_list(raw_colors)
-        for c in mapped_colors:
-            # only count named canonical colors, not hex tokens
-            if c and not c.startswith("#"):
-                color_counter[c] += 1
+    # each product maps independently, so fan the work out across cores;
+    # ex.map preserves input order, and all counters are derived here from
+    # the returned objects so the stats match the old serial loop exactly.
+    # Records whose content hash is already in the shelve cache skip the
+    # pool entirely; only misses are mapped (in batches so the stream stays
+    # bounded) and written back for the next run.
+    products = iter_products()
+    with shelve.open(CACHE_FILE) as cache, ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        def _results():
+            while True:
+                batch = list(islice(products, CACHE_BATCH))
+                if not batch:
+                    return
+                keys = [_product_cache_key(prod) for prod in batch]
+                # decide hit/miss once, before dispatch: re-testing `key in
+                # cache` during consumption would see keys stored earlier in
+                # this same batch (content-identical records) and skip their
+                # next(mapped), desynchronizing every later miss
+                hits = [key in cache for key in keys]
+                misses = [prod for prod, hit in zip(batch, hits) if not hit]
+                mapped = ex.map(process_one_product, misses, chunksize=256)
+                for key, hit in zip(keys, hits):
+                    if hit:
+                        yield cache[key]
+                    else:
+                        result = next(mapped)
+                        cache[key] = result
+                        yield result
+
+        for final_obj, gpt_flag in _results():
+            if gpt_flag:
+                used_gpt += 1
             else:
-                # keep hex tokens for traceability but don't increment canonical counter
-                pass
-        if not mapped_colors:
-            unknown_color_count += 1
-
-        # fabrics
-        raw_fabs = agg.get("fabrics") or []
-        mapped_fabrics = map_generic_list(raw_fabs, FABRIC_SYNONYMS, CANON_FABRICS)
-        for f in mapped_fabrics:
-            fabric_counter[f] += 1
-        if not mapped_fabrics:
-            unknown_fabric_count += 1
-
-        # prints
-        raw_pr = agg.get("prints") or agg.get("prints_patterns") or []
-        mapped_prints = map_generic_list(raw_pr, PRINT_SYNONYMS, CANON_PRINTS)
-
-        # garment type
-        raw_gt = agg.get("garment_type") or ""
-        if isinstance(raw_gt, list):
-            raw_gt = raw_gt[0] if raw_gt else ""
-        gt_mapped = map_generic_list([raw_gt], GARMENT_SYNONYMS, CANON_GARMENT_TYPES)
-        gt_choice = gt_mapped[0] if gt_mapped else "unknown"
-        if gt_choice != "unknown":
-            garment_counter[gt_choice] += 1
-
-        # silhouette, sleeves, neckline, style_fit, length
-        sil = agg.get("silhouette") or ""
-        sil_m = map_generic_list([sil], SILHOUETTE_SYNONYMS, CANON_SILHOUETTES)
-        sil_choice = sil_m[0] if sil_m else "unknown"
-
-        sleeves = agg.get("sleeves") or ""
-        sleeves_m = map_generic_list([sleeves], SLEEVE_SYNONYMS, CANON_SLEEVES)
-        sleeves_choice = sleeves_m[0] if sleeves_m else "unknown"
-
-        neck = agg.get("neckline") or ""
-        neck_m = map_generic_list([neck], NECK_SYNONYMS, CANON_NECKLINES)
-        neck_choice = neck_m[0] if neck_m else "unknown"
-
-        style = agg.get("style_fit") or []
-        style_m = map_generic_list(style, STYLE_SYNONYMS, CANON_STYLE_FIT)
-
-        length = agg.get("length") or ""
-        length_m = map_generic_list([length], LENGTH_SYNONYMS, CANON_LENGTHS)
-        length_choice = length_m[0] if length_m else "unknown"
-
-        # Garment-type aware cleanup rules
-        gtc = (gt_choice or "").lower()
-        if gtc in CLEANUP_RULES:
-            rules = CLEANUP_RULES[gtc]
-            if "length" in rules:
-                length_choice = rules["length"]
-            if "sleeves" in rules:
-                sleeves_choice = rules["sleeves"]
-            if "neckline" in rules:
-                neck_choice = rules["neckline"]
-
-        # Build final product object
-        final_obj = {
-            "group_key": prod.get("group_key") or prod.get("product_url"),
-            "product_url": prod.get("product_url") or prod.get("page_url"),
-            "image_urls": prod.get("vision_summary", {}).get("images", []) or prod.get("image_candidates", []) or prod.get("image_urls", []),
-            "example_title": prod.get("product_title") or prod.get("example_title") or (prod.get("_meta_raw") or {}).get("ld_name") or "",
-            "aggregated": {
-                "colors": mapped_colors,
-                "fabrics": mapped_fabrics,
-                "prints": mapped_prints,
-                "garment_type": gt_choice,
-                "garment_type_confidence": agg.get("garment_type_confidence"),
-                "silhouette": sil_choice,
-                "sleeves": sleeves_choice,
-                "neckline": neck_choice,
-                "style_fit": style_m,
-                "length": length_choice,
-                "images_count": agg.get("images_count", 1)
-            }
-        }
-        final.append(final_obj)
+                used_agg += 1
+            out_agg = final_obj["aggregated"]
+            mapped_colors = out_agg["colors"]
+            # only count named canonical colors, not hex tokens; one C-level
+            # update call instead of a Python increment per element
+            color_counter.update(c for c in mapped_colors if c and not c.startswith("#"))
+            if not mapped_colors:
+                unknown_color_count += 1
+            mapped_fabrics = out_agg["fabrics"]
+            fabric_counter.update(mapped_fabrics)
+            if not mapped_fabrics:
+                unknown_fabric_count += 1
+            if out_agg["garment_type"] != "unknown":
+                garment_counter[out_agg["garment_type"]] += 1
+            final.append(final_obj)
 
     # write out
     outp = Path(output_path)
     outp.parent.mkdir(parents=True, exist_ok=True)
-    outp.write_text(json.dumps(final, ensure_ascii=False, indent=2), encoding="utf-8")
+    # orjson emits UTF-8 bytes directly; stdlib pretty-printing was the
+    # slowest part of writing large outputs
+    outp.write_bytes(orjson.dumps(final, option=orjson.OPT_INDENT_2))
 
     # print summary
     print("Wrote", output_path)
-    print(f"Total products processed: {len(products)}")
+    print(f"Total products processed: {len(final)}")
     print(f"Used gpt_parsed: {used_gpt}, used aggregated fallback: {used_agg}")
     print("Top colors:", color_counter.most_common(20))
     print("Top fabrics:", fabric_counter.most_common(20))
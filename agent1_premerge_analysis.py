@@ -13,10 +13,12 @@ Outputs:
 Edit INPUT_CATALOG / INPUT_SOCIAL constants if your filenames differ.
 """
 import json
+import orjson
 from pathlib import Path
-from urllib.parse import urlparse, urlunparse
 from collections import Counter
+from itertools import islice
 import math
+import numpy as np
 
 # ---------- CONFIG ----------
 INPUT_CATALOG = Path("output/analysis_results_final_updated.json")
@@ -36,13 +38,11 @@ def load_json(p: Path):
         return []
 
 def normalize_image_url(u):
-    if not u: 
+    if not u:
         return None
     try:
-        up = urlparse(u)
-        # remove query and fragment - keep scheme/netloc/path
-        clean = urlunparse((up.scheme, up.netloc, up.path, "", "", ""))
-        return clean.rstrip("/")
+        # remove query and fragment - two partitions, no URL re-assembly
+        return u.partition("?")[0].partition("#")[0].rstrip("/")
     except Exception:
         return u
 
@@ -65,6 +65,18 @@ def first_image_from_record(rec):
             return imgs[0]
     return None
 
+# specialized per-schema extractors: catalog and social records each keep
+# their image in one known place, so the generic multi-key probe above is
+# only a fallback for oddly-shaped records
+def first_image_catalog(rec):
+    v = rec.get("image_urls") or rec.get("image_candidates")
+    if v:
+        return v[0] if isinstance(v, list) else v
+    return first_image_from_record(rec)
+
+def first_image_social(rec):
+    return rec.get("image_url") or first_image_from_record(rec)
+
 def extract_colors_from_catalog(rec):
     # catalog aggregated shape used in your flow
     agg = rec.get("aggregated") or {}
@@ -78,7 +90,7 @@ def extract_colors_from_catalog(rec):
             if n: out.append(str(n).lower())
         else:
             out.append(str(c).lower())
-    return set([x.strip() for x in out if x and x.strip()])
+    return frozenset(x.strip() for x in out if x and x.strip())
 
 def extract_colors_from_social(rec):
     # social style: fashion_analysis.colors or fashion_analysis -> colors
@@ -91,7 +103,7 @@ def extract_colors_from_social(rec):
             if n: out.append(str(n).lower())
         else:
             out.append(str(c).lower())
-    return set([x.strip() for x in out if x and x.strip()])
+    return frozenset(x.strip() for x in out if x and x.strip())
 
 def extract_fabrics_catalog(rec):
     agg = rec.get("aggregated") or {}
@@ -103,7 +115,7 @@ def extract_fabrics_catalog(rec):
             if n: out.append(str(n).lower())
         else:
             out.append(str(f).lower())
-    return set([x.strip() for x in out if x and x.strip()])
+    return frozenset(x.strip() for x in out if x and x.strip())
 
 def extract_fabrics_social(rec):
     fa = rec.get("fashion_analysis") or rec.get("gpt_parsed") or {}
@@ -115,15 +127,14 @@ def extract_fabrics_social(rec):
             if n: out.append(str(n).lower())
         else:
             out.append(str(f).lower())
-    return set([x.strip() for x in out if x and x.strip()])
+    return frozenset(x.strip() for x in out if x and x.strip())
 
 def jaccard(a,b):
+    # callers hand in the frozensets built by the extractors above, so no
+    # defensive set() copies are needed here
     if not a and not b: return None
-    A = set(a or [])
-    B = set(b or [])
-    if not A and not B: return 0.0
-    inter = len(A & B)
-    union = len(A | B)
+    inter = len(a & b)
+    union = len(a | b)
     return inter / union if union else 0.0
 
 # ---------- load ----------
@@ -134,30 +145,42 @@ social = load_json(INPUT_SOCIAL)
 catalog_count = len(catalog)
 social_count = len(social)
 
-# index images
+# index images. Values are bounded [count, rec1, rec2] entries: downstream
+# only ever needs the duplicate count plus at most the first two records per
+# key, so holding every duplicate in the index wastes memory in proportion
+# to the duplication rate
+def _index_add(index, key, rec):
+    entry = index.get(key)
+    if entry is None:
+        index[key] = [1, rec]
+    else:
+        entry[0] += 1
+        if len(entry) < 3:
+            entry.append(rec)
+
 catalog_by_img = {}
 catalog_by_prod = {}
 for rec in catalog:
-    img = first_image_from_record(rec)
+    img = first_image_catalog(rec)
     nimg = normalize_image_url(img) if img else None
     if nimg:
-        catalog_by_img.setdefault(nimg, []).append(rec)
+        _index_add(catalog_by_img, nimg, rec)
     # product_url normalization
     purl = (rec.get("product_url") or rec.get("group_key") or "").rstrip("/")
     if purl:
-        catalog_by_prod.setdefault(purl, []).append(rec)
+        _index_add(catalog_by_prod, purl, rec)
 
 social_by_img = {}
 social_by_post = {}
 for rec in social:
     # friend's social format: image_url, post_url
-    img = rec.get("image_url") or first_image_from_record(rec)
+    img = first_image_social(rec)
     nimg = normalize_image_url(img) if img else None
     if nimg:
-        social_by_img.setdefault(nimg, []).append(rec)
+        _index_add(social_by_img, nimg, rec)
     post = (rec.get("post_url") or rec.get("page_url") or "").rstrip("/")
     if post:
-        social_by_post.setdefault(post, []).append(rec)
+        _index_add(social_by_post, post, rec)
 
 # overlap by exact image URL
 catalog_imgs_set = set(catalog_by_img.keys())
@@ -171,35 +194,51 @@ catalog_prods_set = set(catalog_by_prod.keys())
 social_posts_set = set(social_by_post.keys())
 prod_intersection = catalog_prods_set & social_posts_set
 
-# sample overlap examples (first 50)
+# sample overlap examples (first 50); islice walks the set directly instead
+# of materializing the whole intersection as a list just to slice it
 overlap_samples = []
-for i, img in enumerate(list(img_intersection)[:50]):
-    cat_recs = catalog_by_img.get(img, [])[:2]
-    soc_recs = social_by_img.get(img, [])[:2]
+for img in islice(img_intersection, 50):
+    cat_entry = catalog_by_img[img]
+    soc_entry = social_by_img[img]
     overlap_samples.append({
         "image_url": img,
-        "catalog_examples_count": len(catalog_by_img.get(img, [])),
-        "social_examples_count": len(social_by_img.get(img, [])),
-        "catalog_examples": [{"product_url": c.get("product_url") or c.get("group_key"), "title": c.get("example_title")} for c in cat_recs],
-        "social_examples": [{"post_url": s.get("post_url") or s.get("page_url"), "caption": (s.get("caption_text") or "")[:200]} for s in soc_recs]
+        "catalog_examples_count": cat_entry[0],
+        "social_examples_count": soc_entry[0],
+        "catalog_examples": [{"product_url": c.get("product_url") or c.get("group_key"), "title": c.get("example_title")} for c in cat_entry[1:]],
+        "social_examples": [{"post_url": s.get("post_url") or s.get("page_url"), "caption": (s.get("caption_text") or "")[:200]} for s in soc_entry[1:]]
     })
 
-# attribute agreement: sample first 500 pairs where image matches
+# attribute agreement: average over the first 500 image-matched pairs, but
+# only keep raw dicts for the first 50 (auditability); the averages come from
+# flat float arrays instead of re-walking a list of dicts
+MAX_AGREEMENT_PAIRS = 500
+AGREEMENT_SAMPLE_SIZE = 50
 color_agreements = []
 fabric_agreements = []
+cj_arr = np.empty(MAX_AGREEMENT_PAIRS, dtype=np.float64)
+fj_arr = np.empty(MAX_AGREEMENT_PAIRS, dtype=np.float64)
+cj_n = 0
+fj_n = 0
 pair_count = 0
-for img in list(img_intersection)[:500]:
-    cats = catalog_by_img.get(img, [])
-    socs = social_by_img.get(img, [])
-    # compare first pair each
-    for c in cats[:1]:
-        for s in socs[:1]:
+for img in islice(img_intersection, MAX_AGREEMENT_PAIRS):
+    # compare first pair each (entry slot 1 is the first record seen)
+    for c in catalog_by_img[img][1:2]:
+        for s in social_by_img[img][1:2]:
             c_colors = extract_colors_from_catalog(c)
             s_colors = extract_colors_from_social(s)
             c_fabs = extract_fabrics_catalog(c)
             s_fabs = extract_fabrics_social(s)
-            color_agreements.append({"image_url":img, "catalog_colors":list(c_colors), "social_colors":list(s_colors), "jaccard": jaccard(c_colors, s_colors)})
-            fabric_agreements.append({"image_url":img, "catalog_fabrics":list(c_fabs), "social_fabrics":list(s_fabs), "jaccard": jaccard(c_fabs, s_fabs)})
+            cjac = jaccard(c_colors, s_colors)
+            fjac = jaccard(c_fabs, s_fabs)
+            if cjac is not None:
+                cj_arr[cj_n] = cjac
+                cj_n += 1
+            if fjac is not None:
+                fj_arr[fj_n] = fjac
+                fj_n += 1
+            if pair_count < AGREEMENT_SAMPLE_SIZE:
+                color_agreements.append({"image_url":img, "catalog_colors":list(c_colors), "social_colors":list(s_colors), "jaccard": cjac})
+                fabric_agreements.append({"image_url":img, "catalog_fabrics":list(c_fabs), "social_fabrics":list(s_fabs), "jaccard": fjac})
             pair_count += 1
 
 # compute basic stats
@@ -218,21 +257,19 @@ report = {
     "fabric_jaccard_avg": None
 }
 
-# average jaccard
-cj = [x["jaccard"] for x in color_agreements if x["jaccard"] is not None]
-fj = [x["jaccard"] for x in fabric_agreements if x["jaccard"] is not None]
-report["color_jaccard_avg"] = (sum(cj)/len(cj)) if cj else None
-report["fabric_jaccard_avg"] = (sum(fj)/len(fj)) if fj else None
+# average jaccard: one vectorized mean over the collected floats
+report["color_jaccard_avg"] = float(cj_arr[:cj_n].mean()) if cj_n else None
+report["fabric_jaccard_avg"] = float(fj_arr[:fj_n].mean()) if fj_n else None
 
 # write outputs
-OUT_DIR.joinpath("premerge_report.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
-OUT_DIR.joinpath("premerge_overlap_samples.json").write_text(json.dumps(overlap_samples, indent=2, ensure_ascii=False), encoding="utf-8")
+OUT_DIR.joinpath("premerge_report.json").write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+OUT_DIR.joinpath("premerge_overlap_samples.json").write_bytes(orjson.dumps(overlap_samples, option=orjson.OPT_INDENT_2))
 # write the lists of unique (image-only) identifiers (just URLs) for manual inspection
-OUT_DIR.joinpath("premerge_catalog_unique_images.json").write_text(json.dumps(list(img_only_catalog)[:5000], indent=2), encoding="utf-8")
-OUT_DIR.joinpath("premerge_social_unique_images.json").write_text(json.dumps(list(img_only_social)[:5000], indent=2), encoding="utf-8")
-# write attribute agreement samples
-OUT_DIR.joinpath("premerge_color_agreements.json").write_text(json.dumps(color_agreements[:500], indent=2, ensure_ascii=False), encoding="utf-8")
-OUT_DIR.joinpath("premerge_fabric_agreements.json").write_text(json.dumps(fabric_agreements[:500], indent=2, ensure_ascii=False), encoding="utf-8")
+OUT_DIR.joinpath("premerge_catalog_unique_images.json").write_bytes(orjson.dumps(list(islice(img_only_catalog, 5000)), option=orjson.OPT_INDENT_2))
+OUT_DIR.joinpath("premerge_social_unique_images.json").write_bytes(orjson.dumps(list(islice(img_only_social, 5000)), option=orjson.OPT_INDENT_2))
+# write attribute agreement samples (already capped at AGREEMENT_SAMPLE_SIZE)
+OUT_DIR.joinpath("premerge_color_agreements.json").write_bytes(orjson.dumps(color_agreements, option=orjson.OPT_INDENT_2))
+OUT_DIR.joinpath("premerge_fabric_agreements.json").write_bytes(orjson.dumps(fabric_agreements, option=orjson.OPT_INDENT_2))
 
 print("WROTE report ->", OUT_DIR / "premerge_report.json")
 print("Summary:")
@@ -15,13 +15,25 @@ What it does:
   - Saves results for each product
 """
 
-import os, json, asyncio, aiohttp, aiofiles, hashlib
+import os, orjson, asyncio, aiohttp, aiofiles, hashlib, threading
 from pathlib import Path
 from PIL import Image
 from io import BytesIO
 from tqdm.asyncio import tqdm
 from dotenv import load_dotenv
 
+import vision_cache
+import vision_client
+
+try:
+    # lossless JPEG crops via libjpeg-turbo's tjTransform: no pixel
+    # decode, no recompress. TurboJPEG() raises when the native lib is
+    # absent, so failure of either step drops us back to Pillow.
+    from turbojpeg import TurboJPEG
+    _turbojpeg = TurboJPEG()
+except Exception:
+    _turbojpeg = None
+
 # ---------- Setup ----------
 load_dotenv()
 ENDPOINT = os.environ.get("AZURE_VISION_ENDPOINT")
@@ -29,7 +41,9 @@ KEY = os.environ.get("AZURE_VISION_KEY")
 OUTPUT_JSON = Path(os.environ.get("OUTPUT_JSON", "output/analysis_results_updated.json"))
 TO_ENRICH = Path("output/to_enrich.json")
 
-HEADERS = {"Ocp-Apim-Subscription-Key": KEY}
+NUM_WORKERS = 16   # fixed worker pool is the concurrency limit
+QUEUE_MAX = 64     # bounds products in flight, keeps memory flat
+FLUSH_EVERY = 64   # NDJSON lines buffered before hitting the disk
 
 # ---------- Utilities ----------
 def fname_from_url(url: str) -> str:
@@ -37,35 +51,86 @@ def fname_from_url(url: str) -> str:
     ext = Path(url.split("?")[0]).suffix or ".jpg"
     return f"{h}{ext}"
 
+# in-flight dedupe: concurrent requests for the same key await one task
+# instead of racing duplicate POSTs before the disk cache is populated
+_inflight = {}
+
+async def _cached_vision(key, call):
+    cached = await asyncio.to_thread(vision_cache.get, key)
+    if cached is not None:
+        return cached
+    task = _inflight.get(key)
+    if task is None:
+        async def _fetch_and_store():
+            res = await call()
+            if "error" not in res:
+                await asyncio.to_thread(vision_cache.put, key, res)
+            return res
+        task = asyncio.create_task(_fetch_and_store())
+        _inflight[key] = task
+        task.add_done_callback(lambda _t: _inflight.pop(key, None))
+    return await task
+
 async def analyze_image_url(session: aiohttp.ClientSession, image_url: str):
-    api = f"{ENDPOINT}/vision/v3.2/analyze?visualFeatures=Color,Objects,Tags,Description"
-    headers = {**HEADERS, "Content-Type": "application/json"}
-    payload = {"url": image_url}
-    async with session.post(api, headers=headers, json=payload, timeout=60) as r:
-        return await r.json()
+    features = "Color,Objects,Tags,Description"
+    async def _call():
+        return await vision_client.analyze_url(session, ENDPOINT, KEY, image_url, features)
+    return await _cached_vision(vision_cache.cache_key(image_url, features), _call)
 
 async def analyze_image_bytes(session: aiohttp.ClientSession, image_bytes: bytes):
-    api = f"{ENDPOINT}/vision/v3.2/analyze?visualFeatures=Color,Tags,Description"
-    headers = {**HEADERS, "Content-Type": "application/octet-stream"}
-    async with session.post(api, headers=headers, data=image_bytes, timeout=60) as r:
-        return await r.json()
+    features = "Color,Tags,Description"
+    async def _call():
+        return await vision_client.analyze_bytes(session, ENDPOINT, KEY, image_bytes, features)
+    return await _cached_vision(vision_cache.cache_key(image_bytes, features), _call)
+
+# one JPEG encode buffer per thread, rewound between crops: capacity is
+# kept (not shrunk) across similarly sized crops so the Pillow path stops
+# allocating a fresh BytesIO per detected object
+_local = threading.local()
+
+def _crop_buf():
+    buf = getattr(_local, "crop_buf", None)
+    if buf is None:
+        buf = _local.crop_buf = BytesIO()
+    buf.seek(0)
+    buf.truncate(0)
+    return buf
 
 def crop_image_bytes(image_bytes: bytes, rect):
-    img = Image.open(BytesIO(image_bytes)).convert("RGB")
     x, y, w, h = rect["x"], rect["y"], rect["w"], rect["h"]
     x, y, w, h = int(x), int(y), int(w), int(h)
+    if _turbojpeg is not None and image_bytes[:2] == b"\xff\xd8":
+        try:
+            return _turbojpeg.crop(image_bytes, x, y, w, h, preserve=False)
+        except Exception:
+            pass  # exotic JPEG variant — use the decode/recompress path
+    img = Image.open(BytesIO(image_bytes)).convert("RGB")
     x2, y2 = x + w, y + h
     x, y = max(0, x), max(0, y)
     x2, y2 = min(img.width, x2), min(img.height, y2)
     crop = img.crop((x, y, x2, y2))
-    buf = BytesIO()
+    buf = _crop_buf()
     crop.save(buf, format="JPEG")
     return buf.getvalue()
 
+async def _fetch_bytes(session: aiohttp.ClientSession, url: str):
+    try:
+        async with session.get(url, timeout=30) as r:
+            if r.status != 200:
+                return None
+            return await r.read()
+    except Exception:
+        return None
+
 async def process_image(session: aiohttp.ClientSession, image_url: str):
+    # start the image download while the first Vision call is in flight;
+    # when objects come back the bytes for cropping are (mostly) here
+    # already instead of costing a second serial round trip
+    fetch_task = asyncio.create_task(_fetch_bytes(session, image_url))
     try:
         res = await analyze_image_url(session, image_url)
     except Exception as e:
+        fetch_task.cancel()
         return {"image_url": image_url, "error": str(e)}
 
     output = {
@@ -80,13 +145,11 @@ async def process_image(session: aiohttp.ClientSession, image_url: str):
     }
 
     objects = res.get("objects", [])
-    if objects:
-        try:
-            async with session.get(image_url, timeout=30) as r:
-                if r.status != 200:
-                    return output
-                image_bytes = await r.read()
-        except Exception:
+    if not objects:
+        fetch_task.cancel()
+    else:
+        image_bytes = await fetch_task
+        if image_bytes is None:
             return output
 
         for obj in objects:
@@ -110,45 +173,90 @@ async def process_image(session: aiohttp.ClientSession, image_url: str):
             })
     return output
 
+def convert_ndjson_to_json(ndjson_path, json_path):
+    """Transcode the streamed NDJSON into the pretty JSON array the rest of
+    the pipeline reads. Returns the number of products."""
+    results = [orjson.loads(l) for l in open(ndjson_path, "rb") if l.strip()]
+    Path(json_path).write_bytes(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    return len(results)
+
 # ---------- Main ----------
 async def main():
     if not TO_ENRICH.exists():
         print("Missing to_enrich.json — run merge_playwright_and_filter.py first")
         return
 
-    to_enrich = json.load(open(TO_ENRICH, encoding="utf-8"))
-    results = []
+    to_enrich = orjson.loads(TO_ENRICH.read_bytes())
+
+    OUTPUT_JSON.parent.mkdir(parents=True, exist_ok=True)
+    ndjson_path = OUTPUT_JSON.with_suffix(".ndjson")
+
+    # results stream to NDJSON as they complete (a crash keeps all finished
+    # products); lines are buffered and flushed every FLUSH_EVERY entries to
+    # amortize write syscalls
+    buf = bytearray()
+    pending = 0
+    write_lock = asyncio.Lock()
 
-    async with aiohttp.ClientSession() as session:
-        sem = asyncio.Semaphore(8)  # adjust concurrency
+    async with vision_client.make_session() as session, \
+               aiofiles.open(ndjson_path, "wb") as out_f:
 
         async def handle_product(prod):
-            async with sem:
-                product_url = prod.get("url")
-                filtered_imgs = prod.get("image_candidates_filtered", [])[:3]
-                product_result = {
-                    "product_url": product_url,
-                    "image_candidates": filtered_imgs,
-                    "vision_results": []
-                }
-                for img_url in filtered_imgs:
-                    try:
-                        out = await process_image(session, img_url)
-                        product_result["vision_results"].append(out)
-                    except Exception as e:
-                        product_result["vision_results"].append({"image_url": img_url, "error": str(e)})
-                return product_result
-
-        tasks = [handle_product(p) for p in to_enrich]
-        for fut in tqdm.as_completed(tasks, total=len(tasks)):
-            res = await fut
-            if res:
-                results.append(res)
+            product_url = prod.get("url")
+            filtered_imgs = prod.get("image_candidates_filtered", [])[:3]
+            product_result = {
+                "product_url": product_url,
+                "image_candidates": filtered_imgs,
+                "vision_results": []
+            }
+            for img_url in filtered_imgs:
+                try:
+                    out = await process_image(session, img_url)
+                    product_result["vision_results"].append(out)
+                except Exception as e:
+                    product_result["vision_results"].append({"image_url": img_url, "error": str(e)})
+            return product_result
 
-    OUTPUT_JSON.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-    print("Wrote", OUTPUT_JSON)
+        # bounded producer/worker pipeline: only ~QUEUE_MAX products are in
+        # flight at once, instead of one pending task per catalog entry
+        queue = asyncio.Queue(maxsize=QUEUE_MAX)
+        progress = tqdm(total=len(to_enrich))
+
+        async def write_result(res):
+            nonlocal pending
+            line = orjson.dumps(res)
+            async with write_lock:
+                buf.extend(line)
+                buf.extend(b"\n")
+                pending += 1
+                if pending >= FLUSH_EVERY:
+                    await out_f.write(bytes(buf))
+                    buf.clear()
+                    pending = 0
+
+        async def worker():
+            while True:
+                prod = await queue.get()
+                try:
+                    res = await handle_product(prod)
+                    if res:
+                        await write_result(res)
+                finally:
+                    progress.update(1)
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(NUM_WORKERS)]
+        for prod in to_enrich:
+            await queue.put(prod)
+        await queue.join()
+        for w in workers:
+            w.cancel()
+        progress.close()
+        if buf:
+            await out_f.write(bytes(buf))
+
+    n = convert_ndjson_to_json(ndjson_path, OUTPUT_JSON)
+    print("Wrote", OUTPUT_JSON, f"({n} products)")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,7 +1,18 @@
 #!/usr/bin/env python3
-import re, json, time, requests
+import re, json, orjson, asyncio, aiohttp
+from collections import deque
+from pathlib import Path
+from urllib.parse import urljoin
+
+try:
+    # C-backed parser, ~10-30x faster than html.parser for these pages
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse, urlunparse
+
+import vision_cache
+import vision_client
 
 HEADERS = {"User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
 INPUT = "product_pages.txt"
@@ -9,66 +20,108 @@ OUT = "output/clean_product_pages.json"
 AZURE_VISION_ENDPOINT = "https://velta-md43xkh4-eastus2.cognitiveservices.azure.com/"  # keep in env in real run
 AZURE_VISION_KEY = None  # load from env if you want pre-checks
 
+# typical clothing tags:
+CLOTHING_TAGS = frozenset({"clothing","dress","shirt","trousers","sari","kurta","top","skirt","leheng a","blouse"})
+# tags that suggest a non-product image (logo, banner, screenshot)
+REJECT_TAGS = frozenset({"logo","text","screenshot","icon"})
+
+_TRAIL_RE = re.compile(r"[\s,;]+$")
+
 def normalize(url):
-    s = url.strip()
-    s = re.sub(r'[\s,;]+$', '', s)                       # remove trailing punctuation
+    # plain string ops: the old urlparse+urlunparse round trip allocated
+    # a ParseResult per URL just to strip the fragment
+    s = _TRAIL_RE.sub("", url.strip())                   # remove trailing punctuation
     s = s.replace('//collections/', '/collections/')     # simple double-slash fix for path portion
     # ensure scheme
     if not s.startswith("http"):
         s = "https://" + s.lstrip("/")
-    p = urlparse(s)
-    # reconstruct (remove fragment)
-    return urlunparse((p.scheme, p.netloc, p.path or "/", "", p.query or "", ""))
+    # remove fragment
+    i = s.find("#")
+    if i >= 0:
+        s = s[:i]
+    # bare-host URLs keep the trailing "/" urlunparse used to add
+    if "/" not in s[s.find("://") + 3:]:
+        s += "/"
+    return s
 
-def extract_images_from_html(html, base):
+def _page_bits_selectolax(html):
+    tree = HTMLParser(html)
+    jsonld = [s.text() or "" for s in tree.css('script[type="application/ld+json"]')]
+    og = tree.css_first('meta[property="og:image"]')
+    og = og.attributes.get("content") if og else None
+    link = tree.css_first('link[rel="image_src"]')
+    link = link.attributes.get("href") if link else None
+    imgs = [(n.attributes.get("src"), (n.attributes.get("class") or "").lower())
+            for n in tree.css("img[src]")]
+    return jsonld, og, link, [(s, c) for s, c in imgs if s]
+
+def _page_bits_bs4(html):
     soup = BeautifulSoup(html, "html.parser")
+    jsonld = [s.string or "" for s in soup.select('script[type="application/ld+json"]')]
+    og = soup.find("meta", property="og:image")
+    og = og.get("content") if og else None
+    link = soup.find("link", rel="image_src")
+    link = link.get("href") if link else None
+    imgs = [(im["src"], " ".join(im.get("class", [])).lower())
+            for im in soup.find_all("img", src=True)]
+    return jsonld, og, link, imgs
+
+def _find_product_images(root):
+    # iterative DFS over the JSON-LD graph: no per-call closure, no
+    # recursion limit on deeply nested @graph blocks. Children are pushed
+    # reversed so pop() visits them in document order, matching the old
+    # recursive first-match behaviour.
+    stack = deque([root])
+    while stack:
+        o = stack.pop()
+        if isinstance(o, dict):
+            imgs = o.get("image")
+            if imgs and str(o.get("@type","")).lower() == "product":
+                return imgs if isinstance(imgs, list) else [imgs]
+            stack.extend(reversed(list(o.values())))
+        elif isinstance(o, list):
+            stack.extend(reversed(o))
+    return None
+
+def extract_images_from_html(html, base):
+    # selectolax (C parser) when installed, html.parser otherwise
+    bits = _page_bits_selectolax if HTMLParser else _page_bits_bs4
+    jsonld_blocks, og_content, link_href, img_tags = bits(html)
     images = []
     # 1) JSON-LD product image
-    for script in soup.select('script[type="application/ld+json"]'):
+    for block in jsonld_blocks:
         try:
-            data = json.loads(script.string or "{}")
+            data = orjson.loads(block or "{}")
         except Exception:
             continue
-        def walk(o):
-            if isinstance(o, dict):
-                if o.get("@type","").lower() == "product" and o.get("image"):
-                    imgs = o.get("image")
-                    if isinstance(imgs, list):
-                        return imgs
-                    return [imgs]
-                for v in o.values():
-                    r = walk(v)
-                    if r:
-                        return r
-            elif isinstance(o, list):
-                for it in o:
-                    r = walk(it)
-                    if r:
-                        return r
-            return None
-        found = walk(data)
+        if not isinstance(data, (dict, list)):
+            continue
+        found = _find_product_images(data)
         if found:
             for f in found:
                 images.append(urljoin(base, f))
     # 2) og:image
-    og = soup.find("meta", property="og:image")
-    if og and og.get("content"):
-        images.append(urljoin(base, og["content"]))
+    if og_content:
+        images.append(urljoin(base, og_content))
     # 3) link rel=image_src
-    linkimg = soup.find("link", rel="image_src")
-    if linkimg and linkimg.get("href"):
-        images.append(urljoin(base, linkimg["href"]))
-    # 4) first product-gallery <img> or main <img> with class containing 'product' or 'main'
-    imgs = soup.find_all("img", src=True)
-    for im in imgs[:20]:
-        src = im["src"]
-        cls = " ".join(im.get("class",[])).lower()
-        if "product" in cls or "hero" in cls or "main" in cls or "gallery" in cls:
-            images.append(urljoin(base, src))
-    # fallback: first large image
-    for im in imgs:
-        src = im["src"]
-        images.append(urljoin(base, src))
+    if link_href:
+        images.append(urljoin(base, link_href))
+    # 4) product-gallery/main <img>s first, everything else as fallback —
+    # one pass with early src dedup, so each image is classed and joined once
+    priority, fallback = [], []
+    seen_src = set()
+    for i, (src, cls) in enumerate(img_tags):
+        key = src.split("?")[0]
+        if key in seen_src:
+            continue
+        seen_src.add(key)
+        joined = urljoin(base, src)
+        if i < 20 and ("product" in cls or "hero" in cls or "main" in cls or "gallery" in cls):
+            priority.append(joined)
+        else:
+            fallback.append(joined)
+    images.extend(priority)
+    images.extend(fallback)
     # dedupe preserve order
     seen = set(); out=[]
     for u in images:
@@ -77,34 +130,32 @@ def extract_images_from_html(html, base):
             seen.add(u2); out.append(u)
     return out
 
-def is_clothing_by_vision(img_url):
+async def is_clothing_by_vision(session, img_url):
     # Lightweight check: call Azure Vision 'analyze' for tags (optional).
     # For speed, you can omit this step and rely on schema/org heuristics.
     if not AZURE_VISION_KEY or not AZURE_VISION_ENDPOINT:
         return True, "no-vision-check"
     try:
-        headers = {
-            "Ocp-Apim-Subscription-Key": AZURE_VISION_KEY,
-            "Content-Type": "application/json"
-        }
-        api = AZURE_VISION_ENDPOINT.rstrip("/") + "/vision/v3.2/analyze?visualFeatures=Tags"
-        r = requests.post(api, headers=headers, json={"url": img_url}, timeout=10)
-        if r.status_code == 200:
-            data = r.json()
-            tags = [t['name'] for t in data.get('tags',[])]
-            # typical clothing tags:
-            if any(x in tags for x in ("clothing","dress","shirt","trousers","sari","kurta","top","skirt","leheng a","blouse")):
-                return True, "vision-tags"
-            # if tags include 'logo' or 'text' but not clothing -> reject
-            if any(x in tags for x in ("logo","text","screenshot","icon")):
-                return False, "vision-non-clothing"
-            return True, "vision-ambiguous"
-        else:
-            return True, "vision-unavailable"
+        # same "Tags" namespace as the prefilter, so the two scripts share hits
+        key = vision_cache.cache_key(img_url, "Tags")
+        data = await asyncio.to_thread(vision_cache.get, key)
+        if data is None:
+            data = await vision_client.analyze_url(session, AZURE_VISION_ENDPOINT, AZURE_VISION_KEY,
+                                                   img_url, "Tags", timeout=10)
+            if "error" in data:
+                return True, "vision-unavailable"
+            await asyncio.to_thread(vision_cache.put, key, data)
+        tags = {t['name'] for t in data.get('tags',[])}
+        if tags & CLOTHING_TAGS:
+            return True, "vision-tags"
+        # if tags include 'logo' or 'text' but not clothing -> reject
+        if tags & REJECT_TAGS:
+            return False, "vision-non-clothing"
+        return True, "vision-ambiguous"
     except Exception as e:
         return True, "vision-error"
 
-def main():
+async def main():
     lines = open(INPUT).read().splitlines()
     normalized = []
     for l in lines:
@@ -115,32 +166,46 @@ def main():
     for u in normalized:
         if u not in seen:
             seen.add(u); normalized2.append(u)
-    results=[]
-    for i,u in enumerate(normalized2):
-        if i % 100 == 0: print("checked", i)
-        try:
-            r = requests.get(u, headers=HEADERS, timeout=15)
-            if r.status_code != 200:
-                results.append({"url":u, "ok":False, "reason":f"http_{r.status_code}"})
-                continue
-            imgs = extract_images_from_html(r.text, u)
-            if not imgs:
-                results.append({"url":u, "ok":False, "reason":"no_images_found"})
-                continue
-            # check first candidate image with Azure (optional)
-            ok, reason = is_clothing_by_vision(imgs[0])
-            results.append({
-                "url":u,
-                "ok": ok,
-                "reason": reason,
-                "image_candidates": imgs[:5]
-            })
-        except Exception as e:
-            results.append({"url":u, "ok":False, "reason":"fetch_error"})
-        time.sleep(0.25)
+
+    # one pooled session for page fetches and vision checks; the semaphore
+    # bounds in-flight requests instead of the old 250 ms sleep per URL
+    sem = asyncio.Semaphore(20)
+    checked = 0
+    async with vision_client.make_session() as session:
+        async def check(u):
+            nonlocal checked
+            async with sem:
+                checked += 1
+                if checked % 100 == 0: print("checked", checked)
+                try:
+                    async with session.get(u, headers=HEADERS,
+                                           timeout=aiohttp.ClientTimeout(total=15)) as r:
+                        if r.status != 200:
+                            return {"url":u, "ok":False, "reason":f"http_{r.status}"}
+                        html = await r.text()
+                except Exception as e:
+                    return {"url":u, "ok":False, "reason":"fetch_error"}
+                # BeautifulSoup parsing is CPU-bound; run it on a thread so
+                # the event loop keeps the other fetches moving
+                imgs = await asyncio.to_thread(extract_images_from_html, html, u)
+                if not imgs:
+                    return {"url":u, "ok":False, "reason":"no_images_found"}
+                # probe candidates with parallel HEADs and spend the Vision
+                # call on the largest real image, not a header logo
+                best = await vision_client.pick_best_candidate(session, imgs[:5])
+                ok, reason = await is_clothing_by_vision(session, best)
+                return {
+                    "url":u,
+                    "ok": ok,
+                    "reason": reason,
+                    "image_candidates": imgs[:5]
+                }
+
+        results = list(await asyncio.gather(*[check(u) for u in normalized2]))
+
     good = [r for r in results if r["ok"]]
-    open(OUT,"w",encoding="utf-8").write(json.dumps({"all":results, "good":good}, ensure_ascii=False, indent=2))
+    Path(OUT).write_bytes(orjson.dumps({"all":results, "good":good}, option=orjson.OPT_INDENT_2))
     print("done. total:", len(results), "good:", len(good))
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,54 +1,76 @@
 #!/usr/bin/env python3
 # vision_prefilter.py
-import os, json, time, requests
-from urllib.parse import urljoin
+import os, orjson, asyncio, aiohttp
+from pathlib import Path
+
+import vision_cache
+import vision_client
 
 AZURE_VISION_ENDPOINT = os.environ.get("AZURE_VISION_ENDPOINT")
 AZURE_VISION_KEY = os.environ.get("AZURE_VISION_KEY")
 INPUT = "output/clean_product_pages.json"   # your validator output
 OUT = "output/to_enrich.json"
+CONCURRENCY = 20   # per-host gate; replaces the old time.sleep pacing
+
+async def call_vision_tags(session, image_url, timeout=12):
+    # "Tags" namespace is shared with the validator's check, so an image
+    # already tagged there is a free cache hit here
+    key = vision_cache.cache_key(image_url, "Tags")
+    cached = await asyncio.to_thread(vision_cache.get, key)
+    if cached is not None:
+        return cached
+    res = await vision_client.analyze_url(session, AZURE_VISION_ENDPOINT, AZURE_VISION_KEY,
+                                          image_url, "Tags", timeout=timeout)
+    if "error" in res:
+        return res
+    await asyncio.to_thread(vision_cache.put, key, res)
+    return res
 
-def call_vision_tags(image_url, timeout=12):
-    api = f"{AZURE_VISION_ENDPOINT.rstrip('/')}/vision/v3.2/analyze"
-    params = {"visualFeatures":"Tags"}
-    headers = {"Ocp-Apim-Subscription-Key": AZURE_VISION_KEY, "Content-Type":"application/json"}
-    try:
-        r = requests.post(api, headers=headers, params=params, json={"url": image_url}, timeout=timeout)
-        if r.status_code!=200:
-            return {"error": f"{r.status_code}"}
-        return r.json()
-    except Exception as e:
-        return {"error": str(e)}
+# allow clothing OR person + clothing-related words in tags
+CLOTHING_TOKENS = frozenset({"clothing","dress","shirt","top","saree","kurta","blouse","pant","trousers","skirt","lehenga","outfit"})
+PERSON_TOKENS = frozenset({"person","human","woman","man","female","male","model"})
+CLOTHING_IN_COMBO = frozenset({"clothing","dress","top","shirt"})
 
 def passes_tags(tags_json):
     # tags_json: result from Vision analyze; return True if clothing/person found
-    tags = [t.get("name","").lower() for t in tags_json.get("tags",[])]
-    # allow clothing OR person + clothing-related words in tags
-    clothing_tokens = {"clothing","dress","shirt","top","saree","kurta","blouse","pant","trousers","skirt","lehenga","outfit"}
-    person_tokens = {"person","human","woman","man","female","male","model"}
-    if any(t in clothing_tokens for t in tags):
+    tags = {t.get("name","").lower() for t in tags_json.get("tags",[])}
+    if tags & CLOTHING_TOKENS:
         return True
-    if any(t in person_tokens for t in tags) and any(t in ("clothing","dress","top","shirt") for t in tags):
-        return True
-    return False
-
-data = json.load(open(INPUT, encoding="utf-8"))
-all_entries = data.get("all", [])   # or use data["good"]/data["all"] depending on shape
-to_enrich = []
-for e in all_entries:
-    if e.get("ok"): 
-        # already good — skip here if you only want to filter false entries
-        continue
-    # pick first candidate image if exists
-    imgs = e.get("image_candidates") or []
-    if not imgs:
-        continue
-    image_url = imgs[0]
-    res = call_vision_tags(image_url)
-    if "error" in res:
-        continue
-    if passes_tags(res):
-        to_enrich.append({"url": e["url"], "image": image_url, "vision": res})
-    time.sleep(0.15)  # polite
-open(OUT,"w",encoding="utf-8").write(json.dumps(to_enrich, ensure_ascii=False, indent=2))
-print("Candidates to enrich:", len(to_enrich))
\ No newline at end of file
+    return bool(tags & PERSON_TOKENS and tags & CLOTHING_IN_COMBO)
+
+async def main():
+    data = orjson.loads(Path(INPUT).read_bytes())
+    all_entries = data.get("all", [])   # or use data["good"]/data["all"] depending on shape
+    candidates = []
+    for e in all_entries:
+        if e.get("ok"):
+            # already good — skip here if you only want to filter false entries
+            continue
+        imgs = e.get("image_candidates") or []
+        if not imgs:
+            continue
+        candidates.append((e["url"], imgs))
+
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async with vision_client.make_session() as session:
+        async def check(url, imgs):
+            async with sem:
+                # HEAD the candidates first: a few hundred bytes of traffic
+                # to avoid spending a paid Vision call on an icon
+                image_url = await vision_client.pick_best_candidate(session, imgs)
+                res = await call_vision_tags(session, image_url)
+            if "error" in res:
+                return None
+            if passes_tags(res):
+                return {"url": url, "image": image_url, "vision": res}
+            return None
+
+        results = await asyncio.gather(*[check(u, imgs) for u, imgs in candidates])
+
+    to_enrich = [r for r in results if r]
+    Path(OUT).write_bytes(orjson.dumps(to_enrich, option=orjson.OPT_INDENT_2))
+    print("Candidates to enrich:", len(to_enrich))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,8 +7,7 @@ Reads:
   - optionally output/analysis_results_final_updated.json (for catalog examples)
 
 Writes:
-  - agent2_inputs/*.json
-  - agent2_inputs/index.json
+  - agent2_inputs.zip (payload_*.json entries + index.json manifest)
 
 Payload schema is simple and ready to feed to your GPT-5-chat multimodal call:
 {
@@ -19,20 +18,23 @@ Payload schema is simple and ready to feed to your GPT-5-chat multimodal call:
 }
 """
 
-import json, uuid, os
+import orjson, uuid, os, zipfile
+from collections import defaultdict
 from pathlib import Path
 from datetime import datetime
 
 # ---------- Config ----------
 TRENDS_FILE = Path("output/trends_index.json")
 CATALOG_FILE = Path("output/analysis_results_final_updated.json")  # optional
-OUT_DIR = Path("agent2_inputs")
+OUT_ZIP = Path("agent2_inputs.zip")
+# one timestamp and one urandom read per run; payload ids are run-id +
+# sequence number instead of a uuid4 (getrandom syscall) per payload
+RUN_TS = datetime.utcnow().isoformat() + "Z"
+RUN_ID = uuid.uuid4().hex[:8]
 TOP_COMBOS_TO_USE = 40        # how many combo payloads to write (if available)
 TOP_PER_CATEGORY = 5         # how many items to take from each top_by_category list
 EXAMPLES_PER_PAYLOAD = 4     # how many example images to include when available
 
-OUT_DIR.mkdir(parents=True, exist_ok=True)
-
 # ---------- Helpful system_prompt (you can edit) ----------
 SYSTEM_PROMPT = (
     "You are an expert fashion product designer assistant. "
@@ -48,28 +50,53 @@ SYSTEM_PROMPT = (
 def load_json(p: Path):
     if not p.exists():
         return None
-    return json.load(open(p, encoding="utf-8"))
+    return orjson.loads(p.read_bytes())
+
+def build_trend_indexes(trends_obj):
+    """
+    One-time lookup tables so pick_examples_for_trend is O(1) per call
+    instead of rescanning trend_entries/top_combos for every payload.
+    Each trend entry is registered under its canonical plus every
+    ":"-suffix of its trend_id (what the old endswith scan matched);
+    each combo under its "type:val" parts and bare values. setdefault
+    keeps first-in-list-wins, matching the old break-on-first-hit loops.
+    """
+    trend_lookup = {}
+    for te in trends_obj.get("trend_entries", []):
+        keys = [te.get("canonical")]
+        tid = te.get("trend_id", "") or ""
+        for i, ch in enumerate(tid):
+            if ch == ":":
+                keys.append(tid[i + 1:])
+        for k in keys:
+            if k is not None:
+                trend_lookup.setdefault(k, te)
+    combo_by_part = {}
+    for c in trends_obj.get("top_combos") or []:
+        combo_key = c.get("combo", "")
+        combo_by_part.setdefault(combo_key, c)
+        for part in combo_key.split("|"):
+            part = part.strip()
+            combo_by_part.setdefault(part, c)
+            if ":" in part:
+                _, val = part.split(":", 1)
+                combo_by_part.setdefault(val.strip(), c)
+    return trend_lookup, combo_by_part
 
 def pick_examples_for_trend(trend_key, trends_obj, catalog_index=None, limit=EXAMPLES_PER_PAYLOAD):
     """
     trend_key: e.g. "color:white" or simply "white" for single lists
-    trends_obj: loaded trends_index.json
+    trends_obj: loaded trends_index.json (indexed once via build_trend_indexes)
     catalog_index: optional dict mapping product_url -> product entry
     Returns list of example dicts {product_url, image_url, title}
     """
-    ex = []
-    # trends.json trend_entries include examples per item — search through them
-    for te in trends_obj.get("trend_entries", []):
-        if te.get("canonical") == trend_key or te.get("trend_id","").endswith(":" + trend_key):
-            ex = te.get("examples", [])[:limit]
-            break
+    te = _TREND_LOOKUP.get(trend_key)
+    ex = te.get("examples", [])[:limit] if te else []
     # if no examples found, check top_combos examples
-    if not ex and trends_obj.get("top_combos"):
-        for c in trends_obj["top_combos"]:
-            # c["combo"] may contain pieces like "color:white | print:florals"
-            if trend_key in c.get("combo", "") or trend_key == c.get("combo", ""):
-                ex = c.get("examples", [])[:limit]
-                break
+    if not ex:
+        c = _COMBO_BY_PART.get(trend_key)
+        if c:
+            ex = c.get("examples", [])[:limit]
     # fallback: try catalog index to grab any image examples for that canonical if provided
     if not ex and catalog_index:
         # catalog_index maps canonical attributes to list of example dicts
@@ -81,25 +108,23 @@ def build_catalog_index(catalog):
     build a simple mapping canonical->examples from catalog items.
     For convenience: keys like "color:white" "fabric:cotton" "garment:dress"
     """
-    idx = {}
+    idx = defaultdict(list)
     for p in catalog:
         url = p.get("product_url") or p.get("group_key")
         imgs = p.get("image_urls") or []
         sample = imgs[0] if imgs else None
         agg = p.get("aggregated", {}) or {}
-        for c in agg.get("colors", []) or []:
-            key = f"color:{c}"
-            idx.setdefault(key, []).append({"product_url": url, "image_url": sample, "title": p.get("example_title")})
-        for f in agg.get("fabrics", []) or []:
-            key = f"fabric:{f}"
-            idx.setdefault(key, []).append({"product_url": url, "image_url": sample, "title": p.get("example_title")})
-        for pr in agg.get("prints", []) or []:
-            key = f"print:{pr}"
-            idx.setdefault(key, []).append({"product_url": url, "image_url": sample, "title": p.get("example_title")})
+        # one entry dict per product, shared by reference across its keys
+        entry = {"product_url": url, "image_url": sample, "title": p.get("example_title")}
+        for c in agg.get("colors") or ():
+            idx[f"color:{c}"].append(entry)
+        for f in agg.get("fabrics") or ():
+            idx[f"fabric:{f}"].append(entry)
+        for pr in agg.get("prints") or ():
+            idx[f"print:{pr}"].append(entry)
         gt = agg.get("garment_type")
         if gt:
-            key = f"garment:{gt}"
-            idx.setdefault(key, []).append({"product_url": url, "image_url": sample, "title": p.get("example_title")})
+            idx[f"garment:{gt}"].append(entry)
     return idx
 
 # ---------- Load inputs ----------
@@ -109,12 +134,14 @@ if not trends:
 
 catalog = load_json(CATALOG_FILE) or []
 catalog_index = build_catalog_index(catalog) if catalog else None
+_TREND_LOOKUP, _COMBO_BY_PART = build_trend_indexes(trends)
 
 print("Loaded trends:", TRENDS_FILE, "catalog items:", len(catalog))
 
 # ---------- Prepare single-trend payloads (by category) ----------
 payload_files = []
 index_list = []
+write_jobs = []   # (entry name, payload) pairs, flushed into the zip below
 
 def safe_canon_list(lst):
     return lst if isinstance(lst, list) else []
@@ -137,9 +164,9 @@ for cat, items in top_by_cat.items():
         continue
     for i, canon in enumerate(items):
         payload = {
-            "id": str(uuid.uuid4()),
+            "id": f"{RUN_ID}-{len(payload_files):06d}",
             "type": "single_trend",
-            "generated_at": datetime.utcnow().isoformat() + "Z",
+            "generated_at": RUN_TS,
             "system_prompt": SYSTEM_PROMPT,
             "user_content": {
                 "mode": "design_from_trend",
@@ -149,10 +176,10 @@ for cat, items in top_by_cat.items():
                 "examples": pick_examples_for_trend(canon, trends, catalog_index, EXAMPLES_PER_PAYLOAD)
             }
         }
-        fname = OUT_DIR / f"payload_single_{cat}_{i:03d}.json"
-        open(fname, "w", encoding="utf-8").write(json.dumps(payload, ensure_ascii=False, indent=2))
-        payload_files.append(str(fname))
-        index_list.append({"file": str(fname), "type": "single_trend", "trend": canon})
+        fname = f"payload_single_{cat}_{i:03d}.json"
+        write_jobs.append((fname, payload))
+        payload_files.append(fname)
+        index_list.append({"file": fname, "type": "single_trend", "trend": canon})
 
 # ---------- Prepare combo payloads ----------
 top_combos = trends.get("top_combos") or []
@@ -181,9 +208,9 @@ for idx, combo in enumerate(top_combos):
                 _, val = p.split(":",1)
                 examples += pick_examples_for_trend(val.strip(), trends, catalog_index, limit=EXAMPLES_PER_PAYLOAD)
     payload = {
-        "id": str(uuid.uuid4()),
+        "id": f"{RUN_ID}-{len(payload_files):06d}",
         "type": "combo",
-        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "generated_at": RUN_TS,
         "system_prompt": SYSTEM_PROMPT,
         "user_content": {
             "mode": "design_from_combo",
@@ -192,17 +219,23 @@ for idx, combo in enumerate(top_combos):
             "examples": examples[:EXAMPLES_PER_PAYLOAD]
         }
     }
-    fname = OUT_DIR / f"payload_combo_{idx:04d}.json"
-    open(fname, "w", encoding="utf-8").write(json.dumps(payload, ensure_ascii=False, indent=2))
-    payload_files.append(str(fname))
-    index_list.append({"file": str(fname), "type": "combo", "combo_key": combo_key})
-
-# ---------- Write index.json ----------
+    fname = f"payload_combo_{idx:04d}.json"
+    write_jobs.append((fname, payload))
+    payload_files.append(fname)
+    index_list.append({"file": fname, "type": "combo", "combo_key": combo_key})
+
+# ---------- Write archive ----------
+# one archive instead of hundreds of sub-KB files: a single sequential
+# write with no per-file metadata overhead. ZIP_STORED because the JSON
+# payloads are tiny; consumers read entries via ZipFile(...).open(name)
 index_obj = {
-    "generated_at": datetime.utcnow().isoformat() + "Z",
+    "generated_at": RUN_TS,
     "payload_count": len(payload_files),
     "files": index_list
 }
-open(OUT_DIR / "index.json", "w", encoding="utf-8").write(json.dumps(index_obj, ensure_ascii=False, indent=2))
+with zipfile.ZipFile(OUT_ZIP, "w", compression=zipfile.ZIP_STORED) as zf:
+    for fname, payload in write_jobs:
+        zf.writestr(fname, orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+    zf.writestr("index.json", orjson.dumps(index_obj, option=orjson.OPT_INDENT_2))
 
-print("Wrote payloads:", len(payload_files), " -> dir:", OUT_DIR)
+print("Wrote payloads:", len(payload_files), " -> archive:", OUT_ZIP)
@@ -12,10 +12,15 @@ Usage:
 import os
 import time
 import json
+import hashlib
+import shutil
 import argparse
+import asyncio
 import random
 from pathlib import Path
 
+from design_summary import design_to_summary
+
 try:
     from google import genai
 except Exception:
@@ -58,29 +63,6 @@ Requirements for the video:
 - Output: photorealistic MP4, duration ~6s.
 """
 
-def design_to_summary(d: dict) -> str:
-    parts = []
-    title = d.get("title") or d.get("design_id") or "Untitled"
-    parts.append(f"Title: {title}.")
-    palette = d.get("color_palette") or d.get("colors") or []
-    if palette: parts.append("Colors: " + ", ".join(palette) + ".")
-    fabrics = d.get("fabrics") or []
-    if fabrics: parts.append("Fabrics: " + ", ".join(fabrics) + ".")
-    garment = d.get("garment_type") or d.get("garment") or ""
-    if garment: parts.append("Garment: " + garment + ".")
-    silhouette = d.get("silhouette") or d.get("style_fit") or ""
-    if silhouette:
-        if isinstance(silhouette, list):
-            parts.append("Silhouette: " + ", ".join(silhouette) + ".")
-        else:
-            parts.append("Silhouette: " + silhouette + ".")
-    if d.get("sleeves"): parts.append("Sleeves: " + d.get("sleeves") + ".")
-    if d.get("neckline"): parts.append("Neckline: " + d.get("neckline") + ".")
-    if d.get("prints_patterns"): parts.append("Prints: " + ", ".join(d.get("prints_patterns")) + ".")
-    tech = d.get("techpack") or d.get("image_prompt")
-    if tech: parts.append("Notes: " + (str(tech)[:400]))
-    return " ".join(parts)
-
 def build_prompt(summary: str, attrs: dict) -> str:
     return PROMPT_TEMPLATE.format(
         gender=attrs.get("gender", "female"),
@@ -91,6 +73,14 @@ def build_prompt(summary: str, attrs: dict) -> str:
         design_summary=summary
     )
 
+# content-addressed cache: same design JSON + attrs -> same prompt -> the
+# video we already paid for. Delete the dir to force regeneration.
+CACHE_DIR = Path("output/.prompt_cache")
+
+def cached_output(prompt: str, suffix: str) -> Path:
+    key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{key}{suffix}"
+
 def submit_video(prompt: str):
     # Use Veo generation via client.models.generate_videos if available
     try:
@@ -100,14 +90,27 @@ def submit_video(prompt: str):
         op = client.generate_videos(model="veo-3.0-generate-001", prompt=prompt)
     return op
 
-def poll_and_download(operation, out_path: Path, timeout=600):
+async def poll_and_download(operation, out_path: Path, timeout=600):
     start = time.time()
+    # exponential backoff (1 s -> 15 s cap) instead of a flat 5 s: fast
+    # completion is detected quickly, long jobs poll a quarter as often;
+    # any server Retry-After hint overrides the computed delay. Awaiting
+    # the sleep lets one event loop multiplex every in-flight operation;
+    # the blocking SDK refresh runs on the default executor.
+    delay = 1.0
     while not getattr(operation, "done", False):
-        time.sleep(5)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 15.0)
         try:
-            operation = client.operations.get(operation)
+            operation = await asyncio.to_thread(client.operations.get, operation)
         except Exception as e:
             print("Warning: poll refresh failed:", e)
+        hint = getattr(operation, "retry_after", None)
+        if hint:
+            try:
+                delay = float(hint)
+            except (TypeError, ValueError):
+                pass
         if time.time() - start > timeout:
             raise TimeoutError("Timed out waiting for Veo operation")
 
@@ -120,15 +123,18 @@ def poll_and_download(operation, out_path: Path, timeout=600):
     if isinstance(vid_field, (bytes, bytearray)):
         data = vid_field
     else:
-        file_obj = client.files.download(file=vid_field)
+        file_obj = await asyncio.to_thread(client.files.download, file=vid_field)
         data = getattr(file_obj, "content", None) or getattr(file_obj, "bytes", None) or file_obj
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
     if isinstance(data, (bytes, bytearray)):
         out_path.write_bytes(data)
     else:
+        # stream file-like payloads in 1 MiB chunks: with several
+        # concurrent downloads, buffering whole MP4s (5-50 MB each) in
+        # memory first adds up fast
         with open(out_path, "wb") as fh:
-            fh.write(data.read())
+            shutil.copyfileobj(data, fh, length=1 << 20)
     return str(out_path)
 
 def parse_model_attrs(args):
@@ -152,6 +158,46 @@ def find_design_files(path: Path):
     files = sorted([p for p in path.iterdir() if p.is_file() and p.suffix == ".json" and "design" in p.name.lower()])
     return files
 
+async def _run_one(f: Path, model_attrs: dict, out_dir: Path, sem: asyncio.Semaphore):
+    """read -> summary -> submit -> poll -> save for one design file."""
+    try:
+        d = json.loads(f.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"Skipping {f.name}: read error {e}")
+        return
+    design_id = d.get("design_id") or f.stem
+    summary = design_to_summary(d)
+    prompt = build_prompt(summary, model_attrs)
+
+    # save storyboard
+    sb_file = out_dir / f"{design_id}_storyboard.txt"
+    sb_file.parent.mkdir(parents=True, exist_ok=True)
+    sb_file.write_text(prompt, encoding="utf-8")
+
+    out_path = out_dir / f"{design_id}_runway.mp4"
+    cached = cached_output(prompt, ".mp4")
+    if cached.exists():
+        shutil.copyfile(cached, out_path)
+        print(f"-> [{design_id}] Prompt unchanged, reused cached video: {out_path}")
+        return
+
+    async with sem:
+        print(f"-> [{design_id}] Submitting Veo request...")
+        try:
+            op = await asyncio.to_thread(submit_video, prompt)
+        except Exception as e:
+            print(f"  Submit failed: {e}. Saved storyboard to {sb_file}")
+            return
+
+        print(f"  [{design_id}] Polling for completion...")
+        try:
+            saved = await poll_and_download(op, out_path)
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(out_path, cached)
+            print(f"  Saved video: {saved}")
+        except Exception as e:
+            print(f"  Failed to get video for {design_id}: {e}. Saved storyboard to {sb_file}")
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--design", type=str, help="single design JSON file")
@@ -165,6 +211,7 @@ def main():
     parser.add_argument("--skin_tone", type=str)
     parser.add_argument("--pose", type=str)
     parser.add_argument("--out-dir", type=str, default="output")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent Veo submissions")
     args = parser.parse_args()
 
     if args.design:
@@ -180,35 +227,16 @@ def main():
     print(f"Found {len(files)} design files to process. model_attrs={model_attrs}")
     out_dir = Path(args.out_dir)
 
-    for f in files:
-        try:
-            d = json.loads(f.read_text(encoding="utf-8"))
-        except Exception as e:
-            print(f"Skipping {f.name}: read error {e}")
-            continue
-        design_id = d.get("design_id") or f.stem
-        summary = design_to_summary(d)
-        prompt = build_prompt(summary, model_attrs)
-
-        # save storyboard
-        sb_file = out_dir / f"{design_id}_storyboard.txt"
-        sb_file.parent.mkdir(parents=True, exist_ok=True)
-        sb_file.write_text(prompt, encoding="utf-8")
+    # Veo generation is server-bound, so designs are embarrassingly
+    # parallel: one event loop multiplexes every in-flight operation at
+    # task (not thread) cost — polling is almost all idle waiting, so the
+    # semaphore only gates how many operations are open server-side.
+    # Wall time goes from the sum of per-video latencies to roughly the max.
+    async def run_all():
+        sem = asyncio.Semaphore(max(1, args.workers))
+        await asyncio.gather(*[_run_one(f, model_attrs, out_dir, sem) for f in files])
 
-        print(f"-> [{design_id}] Submitting Veo request...")
-        try:
-            op = submit_video(prompt)
-        except Exception as e:
-            print(f"  Submit failed: {e}. Saved storyboard to {sb_file}")
-            continue
-
-        print("  Polling for completion...")
-        try:
-            out_path = out_dir / f"{design_id}_runway.mp4"
-            saved = poll_and_download(op, out_path)
-            print(f"  Saved video: {saved}")
-        except Exception as e:
-            print(f"  Failed to get video for {design_id}: {e}. Saved storyboard to {sb_file}")
+    asyncio.run(run_all())
 
 if __name__ == "__main__":
     main()
@@ -20,13 +20,19 @@ Usage:
 
 import os
 import json
+import hashlib
+import shutil
 import argparse
 import random
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from dotenv import load_dotenv
 from PIL import Image
 
+from design_summary import design_to_summary
+
 load_dotenv()
 
 # import gemini wrapper with graceful fallback (works across SDK variants)
@@ -75,25 +81,6 @@ Requirements:
 - Output: high-resolution image (PNG) of the model wearing the garment.
 """
 
-def design_to_summary(d: dict) -> str:
-    parts = []
-    title = d.get("title") or d.get("design_id") or "Untitled"
-    parts.append(f"Title: {title}")
-    palette = d.get("color_palette") or d.get("colors") or []
-    if palette: parts.append("Colors: " + ", ".join(palette))
-    fabrics = d.get("fabrics") or []
-    if fabrics: parts.append("Fabrics: " + ", ".join(fabrics))
-    garment = d.get("garment_type") or d.get("garment") or ""
-    if garment: parts.append("Garment: " + garment)
-    silhouette = d.get("silhouette") or d.get("style_fit") or ""
-    if silhouette: parts.append("Silhouette: " + (silhouette if isinstance(silhouette, str) else ", ".join(silhouette)))
-    if d.get("sleeves"): parts.append("Sleeves: " + d.get("sleeves"))
-    if d.get("neckline"): parts.append("Neckline: " + d.get("neckline"))
-    if d.get("prints_patterns"): parts.append("Prints: " + ", ".join(d.get("prints_patterns")))
-    tech = d.get("techpack") or d.get("image_prompt")
-    if tech: parts.append("Notes: " + (str(tech)[:400]))
-    return ". ".join(parts)
-
 def build_prompt(summary: str, model_attrs: dict) -> str:
     # framing: default full-body studio shot
     framing = model_attrs.get("framing") or "full-body, studio frame, no close-ups"
@@ -107,6 +94,10 @@ def build_prompt(summary: str, model_attrs: dict) -> str:
         design_summary=summary
     )
 
+# content-addressed cache: same design JSON + attrs -> same prompt -> the
+# image we already paid for. Delete the dir to force regeneration.
+CACHE_DIR = Path("output/.prompt_cache")
+
 def showcase_from_design_file(design_file: Path, model_attrs: dict, out_dir: Path):
     d = json.loads(design_file.read_text(encoding="utf-8"))
     design_id = d.get("design_id") or design_file.stem
@@ -118,6 +109,13 @@ def showcase_from_design_file(design_file: Path, model_attrs: dict, out_dir: Pat
     storyboard = out_dir / f"{design_id}_storyboard.txt"
     storyboard.write_text(prompt, encoding="utf-8")
 
+    out_file = out_dir / f"{design_id}_showcase.png"
+    cached = CACHE_DIR / f"{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}.png"
+    if cached.exists():
+        shutil.copyfile(cached, out_file)
+        print(f"-> Prompt unchanged for {design_id}, reused cached showcase: {out_file}")
+        return str(out_file)
+
     # Call Gemini image generate (generate_content shape)
     print(f"-> Generating showcase for {design_id} with attributes {model_attrs}")
     try:
@@ -154,7 +152,6 @@ def showcase_from_design_file(design_file: Path, model_attrs: dict, out_dir: Pat
         raise RuntimeError("No image returned from Gemini for showcase. Inspect response object.")
 
     # Write file
-    out_file = out_dir / f"{design_id}_showcase.png"
     out_file.write_bytes(img_bytes)
 
     # Normalize via PIL (optional)
@@ -164,6 +161,10 @@ def showcase_from_design_file(design_file: Path, model_attrs: dict, out_dir: Pat
     except Exception as e:
         print("⚠️ Pillow normalization skipped:", e)
 
+    # cache the final (normalized) artifact for exact-repeat prompts
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(out_file, cached)
+
     print(f"✅ Saved showcase image: {out_file} ({len(img_bytes)} bytes)")
     return str(out_file)
 
@@ -215,6 +216,7 @@ def main():
     parser.add_argument("--pose", type=str)
     parser.add_argument("--framing", type=str)
     parser.add_argument("--out-dir", type=str, default="output")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent image generations")
     args = parser.parse_args()
 
     if args.design:
@@ -230,11 +232,27 @@ def main():
     out_dir = Path(args.out_dir)
     print(f"Found {len(files)} designs to showcase. Using model_attrs={model_attrs}")
 
-    for f in files:
+    # image generations are independent API calls — run them concurrently,
+    # same pattern as the runway script
+    stop = threading.Event()
+
+    def run_one(f):
+        if stop.is_set():
+            return
         try:
             showcase_from_design_file(f, model_attrs, out_dir)
         except Exception as e:
             print(f"Failed for {f.name}: {e}")
 
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [pool.submit(run_one, f) for f in files]
+        try:
+            for fut in as_completed(futures):
+                fut.result()
+        except KeyboardInterrupt:
+            stop.set()
+            pool.shutdown(cancel_futures=True)
+            raise
+
 if __name__ == "__main__":
     main()
@@ -11,8 +11,12 @@ import json
 import re
 import uuid
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
 
+from design_summary import summarize_design
+
 AZ_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZ_KEY = os.getenv("AZURE_OPENAI_KEY")
 AZ_DEPLOY = os.getenv("AZURE_OPENAI_DEPLOYMENT")
@@ -25,6 +29,16 @@ if not AZ_ENDPOINT or not AZ_KEY or not AZ_DEPLOY:
 CHAT_URL = f"{AZ_ENDPOINT.rstrip('/')}/openai/deployments/{AZ_DEPLOY}/chat/completions?api-version={API_VERSION}"
 HEADERS = {"Content-Type": "application/json", "api-key": AZ_KEY}
 
+# pooled keep-alive session: under a batch driver every apply_change call
+# reuses the same TLS connection instead of handshaking per design, and
+# transient 429/5xx responses retry with backoff
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.5,
+                      status_forcelist=[429, 500, 502, 503, 504])))
+
 SYSTEM_PROMPT = """
 You are a professional fashion product designer assistant.
 You will be given a BASE design JSON and a USER CHANGE instruction in plain text.
@@ -71,22 +85,6 @@ def normalize_choice_content(choice):
         if texts: return "\n".join(texts)
     return json.dumps(choice)
 
-def summarize_design(d: dict) -> str:
-    """Generate human-readable summary (design_text)."""
-    parts = []
-    parts.append(f"{d.get('title','Untitled')} ({d.get('design_id','?')})")
-    if d.get("color_palette"): parts.append("Colors: " + ", ".join(d["color_palette"]))
-    if d.get("fabrics"): parts.append("Fabrics: " + ", ".join(d["fabrics"]))
-    if d.get("prints_patterns"): parts.append("Prints: " + ", ".join(d["prints_patterns"]))
-    if d.get("garment_type"): parts.append(f"Garment: {d['garment_type']}")
-    if d.get("silhouette"): parts.append(f"Silhouette: {d['silhouette']}")
-    if d.get("sleeves"): parts.append(f"Sleeves: {d['sleeves']}")
-    if d.get("neckline"): parts.append(f"Neckline: {d['neckline']}")
-    if d.get("length"): parts.append(f"Length: {d['length']}")
-    if d.get("style_fit"): parts.append("Style/Fit: " + ", ".join(d["style_fit"]))
-    if d.get("trims_and_details"): parts.append("Trims: " + ", ".join(d["trims_and_details"]))
-    return " ".join(parts)
-
 def apply_change(base_design: dict, user_change: str, temperature=0.0):
     base_text = json.dumps(base_design, ensure_ascii=False, indent=2)
     user_message = (
@@ -104,7 +102,7 @@ def apply_change(base_design: dict, user_change: str, temperature=0.0):
         "n": 1
     }
 
-    r = requests.post(CHAT_URL, headers=HEADERS, json=body, timeout=60)
+    r = SESSION.post(CHAT_URL, json=body, timeout=60)
     if r.status_code != 200:
         raise RuntimeError(f"Azure API error {r.status_code}: {r.text}")
 
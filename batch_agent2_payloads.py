@@ -2,28 +2,89 @@
 """
 batch_agent2_payloads.py
 
-Iterates through all payloads in agent2_inputs/ and runs test_agent2_payload.py on each.
+Iterates through all payloads in agent2_inputs.zip and runs test_agent2_payload.py on each.
 Generates design JSONs for all payloads (80+).
+
+Payloads run through a thread pool (--workers) with a token-bucket rate
+limiter (--rps) gating launch rate, instead of the old serial loop with a
+flat 2 s sleep between calls: requests overlap while the start rate stays
+polite to the API. test_agent2_payload is imported and called in-process,
+so the batch pays interpreter startup and module imports once and every
+payload shares the same pooled HTTPS session.
 """
 
-import os, sys, time, subprocess
+import argparse, sys, time, tempfile, threading, zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-payload_dir = Path("agent2_inputs")
-script = "test_agent2_payload.py"
+from test_agent2_payload import process_payload
+
+
+class RateLimiter:
+    """Token bucket: acquire() blocks until the next launch slot is free."""
+    def __init__(self, rps):
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--archive", type=str, default="agent2_inputs.zip")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent payload runs")
+    parser.add_argument("--rps", type=float, default=0.5,
+                        help="payload launch rate (0.5 matches the old 2 s spacing)")
+    args = parser.parse_args()
+
+    archive = Path(args.archive)
+    if not archive.exists():
+        print(f"No {archive} found — run agent2_input_builder.py first.")
+        sys.exit(1)
+
+    limiter = RateLimiter(args.rps)
+    failures = []
+
+    with zipfile.ZipFile(archive) as zf:
+        payloads = sorted(n for n in zf.namelist() if n.startswith("payload_") and n.endswith(".json"))
+        print(f"Found {len(payloads)} payloads.")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            def run_one(name):
+                # process_payload takes a file path, so extract the entry
+                p = Path(zf.extract(name, tmpdir))
+                limiter.acquire()
+                process_payload(p)
+
+            with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+                futs = {ex.submit(run_one, name): name for name in payloads}
+                done = 0
+                for fut in as_completed(futs):
+                    name = futs[fut]
+                    done += 1
+                    try:
+                        fut.result()
+                        print(f"[{done}/{len(payloads)}] ok: {name}")
+                    except Exception as e:
+                        failures.append((name, e))
+                        print(f"[{done}/{len(payloads)}] FAILED: {name}")
 
-if not payload_dir.exists():
-    print("No agent2_inputs/ directory found.")
-    sys.exit(1)
+    if failures:
+        print(f"\n{len(failures)} payload(s) failed:")
+        for name, e in failures:
+            print(f"  {name}: {e}")
+        sys.exit(1)
+    print("All payloads processed.")
 
-payloads = sorted(payload_dir.glob("*.json"))
-print(f"Found {len(payloads)} payloads.")
 
-for i, p in enumerate(payloads, start=1):
-    print(f"\n=== [{i}/{len(payloads)}] Processing {p.name} ===")
-    try:
-        subprocess.run([sys.executable, script, str(p)], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running {p.name}: {e}")
-    # polite small pause to avoid rate limits
-    time.sleep(2)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+design_summary.py
+
+Single home for turning a design JSON into the short human/prompt text
+that agent3_runway_demo, agent3_virtual_showcase_demo and
+apply_text_change each used to build with their own near-identical
+chain of d.get(...) branches. Field lists are data, not code: each entry
+is (label, lookup keys in precedence order), and list values are
+comma-joined automatically, so the three call sites can no longer drift
+apart.
+"""
+
+# prompt summary for the agent3 generation scripts
+_SUMMARY_FIELDS = (
+    ("Colors", ("color_palette", "colors")),
+    ("Fabrics", ("fabrics",)),
+    ("Garment", ("garment_type", "garment")),
+    ("Silhouette", ("silhouette", "style_fit")),
+    ("Sleeves", ("sleeves",)),
+    ("Neckline", ("neckline",)),
+    ("Prints", ("prints_patterns",)),
+)
+
+# design_text line for apply_text_change
+_DESIGN_TEXT_FIELDS = (
+    ("Colors", ("color_palette",)),
+    ("Fabrics", ("fabrics",)),
+    ("Prints", ("prints_patterns",)),
+    ("Garment", ("garment_type",)),
+    ("Silhouette", ("silhouette",)),
+    ("Sleeves", ("sleeves",)),
+    ("Neckline", ("neckline",)),
+    ("Length", ("length",)),
+    ("Style/Fit", ("style_fit",)),
+    ("Trims", ("trims_and_details",)),
+)
+
+
+def _render(d, fields, dot):
+    tail = "." if dot else ""
+    parts = []
+    for label, keys in fields:
+        for k in keys:
+            v = d.get(k)
+            if v:
+                break
+        else:
+            continue
+        if isinstance(v, (list, tuple)):
+            v = ", ".join(v)
+        parts.append(f"{label}: {v}{tail}")
+    return parts
+
+
+def design_to_summary(d: dict) -> str:
+    """Prompt-facing summary, e.g. "Title: X. Colors: a, b. ... Notes: ..."."""
+    title = d.get("title") or d.get("design_id") or "Untitled"
+    parts = [f"Title: {title}."]
+    parts.extend(_render(d, _SUMMARY_FIELDS, dot=True))
+    tech = d.get("techpack") or d.get("image_prompt")
+    if tech:
+        parts.append("Notes: " + str(tech)[:400])
+    return " ".join(parts)
+
+
+def summarize_design(d: dict) -> str:
+    """Generate human-readable summary (design_text)."""
+    parts = [f"{d.get('title','Untitled')} ({d.get('design_id','?')})"]
+    parts.extend(_render(d, _DESIGN_TEXT_FIELDS, dot=False))
+    return " ".join(parts)
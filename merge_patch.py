@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+merge_patch.py
+
+Apply output/merged_catalog.patch.ndjson (the mutated + new records emitted
+by agent1_merge_social_and_catalog.py) onto a base merged catalog, producing
+the same file a full rewrite would — without re-serializing the untouched
+bulk on the producer side.
+
+- Input:
+    output/merged_catalog.ndjson        (base, from a previous full run)
+    output/merged_catalog.patch.ndjson  (delta from the latest merge run)
+- Output:
+    output/merged_catalog.ndjson        (replaced atomically via temp file)
+"""
+
+import orjson
+from pathlib import Path
+
+BASE_FILE = Path("output/merged_catalog.ndjson")
+PATCH_FILE = Path("output/merged_catalog.patch.ndjson")
+
+
+def record_key(item):
+    return item.get("product_url") or item.get("group_key")
+
+
+if not BASE_FILE.exists():
+    print("Base catalog missing:", BASE_FILE)
+    raise SystemExit(1)
+if not PATCH_FILE.exists():
+    print("Patch file missing:", PATCH_FILE)
+    raise SystemExit(1)
+
+# ---------- load patch ----------
+patch_by_key = {}
+keyless = []
+with open(PATCH_FILE, "rb") as f:
+    for line in f:
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        k = record_key(item)
+        if k:
+            patch_by_key[k] = item
+        else:
+            keyless.append(item)
+print("Patch records:", len(patch_by_key) + len(keyless))
+
+# ---------- stream base, replacing patched records ----------
+replaced = 0
+appended = 0
+tmp = BASE_FILE.with_name(BASE_FILE.name + ".tmp")
+applied = set()
+with open(BASE_FILE, "rb") as src, open(tmp, "wb") as dst:
+    for line in src:
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        k = record_key(item)
+        if k is not None and k in patch_by_key:
+            item = patch_by_key[k]
+            applied.add(k)
+            replaced += 1
+        dst.write(orjson.dumps(item))
+        dst.write(b"\n")
+    # records the base has never seen (new social records, keyless fallbacks)
+    for k, item in patch_by_key.items():
+        if k not in applied:
+            dst.write(orjson.dumps(item))
+            dst.write(b"\n")
+            appended += 1
+    for item in keyless:
+        dst.write(orjson.dumps(item))
+        dst.write(b"\n")
+        appended += 1
+tmp.replace(BASE_FILE)
+
+print("Replaced:", replaced, " Appended:", appended)
+print("WROTE patched catalog:", BASE_FILE)
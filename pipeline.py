@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+pipeline.py
+
+Runs the agent1 Azure stages as one process instead of three:
+
+  agent1_validate_product_pages -> agent1_vision_prefilter -> agent1_scrape_and_analyze
+
+The stages are coroutines connected by bounded asyncio.Queues and share a
+single pooled ClientSession, so Vision calls start as soon as the first
+page validates — no interpreter restarts, no TLS re-handshakes, and no
+JSON round-trips to disk between stages. The same three output files are
+still written at the end, so downstream scripts are unaffected.
+
+Usage:
+  python pipeline.py
+"""
+import asyncio
+import aiohttp
+import orjson
+from pathlib import Path
+
+import vision_client
+import agent1_validate_product_pages as validator
+import agent1_vision_prefilter as prefilter
+import agent1_scrape_and_analyze as analyzer
+
+QUEUE_MAX = 256
+STAGE_WORKERS = 8
+_DONE = object()   # sentinel: a stage's workers are finished
+
+
+async def validator_stage(session, urls, q_validated, all_results):
+    """Fetch + validate pages, emitting each result downstream as it lands."""
+    sem = asyncio.Semaphore(20)
+
+    async def check(u):
+        async with sem:
+            try:
+                async with session.get(u, headers=validator.HEADERS,
+                                       timeout=aiohttp.ClientTimeout(total=15)) as r:
+                    if r.status != 200:
+                        return {"url": u, "ok": False, "reason": f"http_{r.status}"}
+                    html = await r.text()
+            except Exception:
+                return {"url": u, "ok": False, "reason": "fetch_error"}
+            imgs = await asyncio.to_thread(validator.extract_images_from_html, html, u)
+            if not imgs:
+                return {"url": u, "ok": False, "reason": "no_images_found"}
+            best = await vision_client.pick_best_candidate(session, imgs[:5])
+            ok, reason = await validator.is_clothing_by_vision(session, best)
+            return {"url": u, "ok": ok, "reason": reason, "image_candidates": imgs[:5]}
+
+    for fut in asyncio.as_completed([check(u) for u in urls]):
+        res = await fut
+        all_results.append(res)
+        await q_validated.put(res)
+    await q_validated.put(_DONE)
+
+
+async def prefilter_stage(session, q_validated, q_prefiltered, to_enrich):
+    """Vision-tag gate. ok pages pass straight through with their candidate
+    list; rejected pages get a second chance via the tags check on their
+    first image (what agent1_vision_prefilter does over the whole file)."""
+    async def handle(entry):
+        imgs = entry.get("image_candidates") or []
+        if entry.get("ok"):
+            item = {"url": entry["url"], "image_candidates_filtered": imgs[:3]}
+        else:
+            if not imgs:
+                return
+            best = await vision_client.pick_best_candidate(session, imgs)
+            res = await prefilter.call_vision_tags(session, best)
+            if "error" in res or not prefilter.passes_tags(res):
+                return
+            item = {"url": entry["url"], "image_candidates_filtered": imgs[:1], "vision": res}
+        to_enrich.append(item)
+        await q_prefiltered.put(item)
+
+    async def worker():
+        while True:
+            entry = await q_validated.get()
+            if entry is _DONE:
+                await q_validated.put(_DONE)   # let sibling workers drain
+                return
+            try:
+                await handle(entry)
+            finally:
+                q_validated.task_done()
+
+    await asyncio.gather(*[worker() for _ in range(STAGE_WORKERS)])
+    await q_prefiltered.put(_DONE)
+
+
+async def analyzer_stage(session, q_prefiltered, analysis_results):
+    """Full Vision analysis per product, same shape as agent1_scrape_and_analyze."""
+    async def worker():
+        while True:
+            prod = await q_prefiltered.get()
+            if prod is _DONE:
+                await q_prefiltered.put(_DONE)
+                return
+            try:
+                product_result = {
+                    "product_url": prod["url"],
+                    "image_candidates": prod.get("image_candidates_filtered", []),
+                    "vision_results": []
+                }
+                for img_url in prod.get("image_candidates_filtered", []):
+                    try:
+                        out = await analyzer.process_image(session, img_url)
+                        product_result["vision_results"].append(out)
+                    except Exception as e:
+                        product_result["vision_results"].append({"image_url": img_url, "error": str(e)})
+                analysis_results.append(product_result)
+            finally:
+                q_prefiltered.task_done()
+
+    await asyncio.gather(*[worker() for _ in range(STAGE_WORKERS)])
+
+
+async def main():
+    lines = open(validator.INPUT).read().splitlines()
+    seen = set()
+    urls = []
+    for l in lines:
+        if not l.strip():
+            continue
+        u = validator.normalize(l)
+        if u not in seen:
+            seen.add(u)
+            urls.append(u)
+
+    q_validated = asyncio.Queue(maxsize=QUEUE_MAX)
+    q_prefiltered = asyncio.Queue(maxsize=QUEUE_MAX)
+    all_results, to_enrich, analysis_results = [], [], []
+
+    async with vision_client.make_session() as session:
+        await asyncio.gather(
+            validator_stage(session, urls, q_validated, all_results),
+            prefilter_stage(session, q_validated, q_prefiltered, to_enrich),
+            analyzer_stage(session, q_prefiltered, analysis_results),
+        )
+
+    # persist the same artifacts the standalone scripts write
+    Path(validator.OUT).parent.mkdir(parents=True, exist_ok=True)
+    good = [r for r in all_results if r["ok"]]
+    Path(validator.OUT).write_bytes(orjson.dumps({"all": all_results, "good": good},
+                                                 option=orjson.OPT_INDENT_2))
+    Path(prefilter.OUT).write_bytes(orjson.dumps(to_enrich, option=orjson.OPT_INDENT_2))
+    analyzer.OUTPUT_JSON.parent.mkdir(parents=True, exist_ok=True)
+    analyzer.OUTPUT_JSON.write_bytes(orjson.dumps(analysis_results, option=orjson.OPT_INDENT_2))
+    print("validated:", len(all_results), "to_enrich:", len(to_enrich),
+          "analyzed:", len(analysis_results))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+vision_cache.py
+
+Small sqlite3-backed cache for Azure Vision responses, shared by
+agent1_validate_product_pages / agent1_vision_prefilter /
+agent1_scrape_and_analyze. Keyed by sha1 of the image URL (or of the raw
+bytes for the crop path) plus the requested feature set, so repeat images
+across products and scripts never cost a second paid API call.
+
+Callers on the event loop should go through asyncio.to_thread(get/put, ...).
+Delete output/.vision_cache.sqlite to reset.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+CACHE_DB = Path("output/.vision_cache.sqlite")
+
+
+def cache_key(url_or_bytes, features=""):
+    """sha1 of the image URL or raw bytes, namespaced by visualFeatures so
+    Tags-only and full analyze responses never collide."""
+    data = url_or_bytes if isinstance(url_or_bytes, bytes) else url_or_bytes.encode("utf-8")
+    h = hashlib.sha1(features.encode("utf-8"))
+    h.update(b"|")
+    h.update(data)
+    return h.hexdigest()
+
+
+def _open():
+    CACHE_DB.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(CACHE_DB)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS vision_cache (key TEXT PRIMARY KEY, response TEXT, created_at REAL)"
+    )
+    return db
+
+
+def get(key):
+    db = _open()
+    try:
+        row = db.execute("SELECT response FROM vision_cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+    finally:
+        db.close()
+
+
+def put(key, response):
+    db = _open()
+    try:
+        db.execute(
+            "INSERT OR REPLACE INTO vision_cache (key, response, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(response), time.time()),
+        )
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+vision_client.py
+
+Shared aiohttp plumbing for the Azure Vision v3.2 analyze calls made by
+agent1_validate_product_pages / agent1_vision_prefilter /
+agent1_scrape_and_analyze. One place owns the pooled connector settings
+and the request/response shape, instead of each script hand-rolling its
+own POST. Non-200 responses come back as {"error": "<status>"} so
+callers (and the vision_cache layer) can skip caching failures.
+"""
+import asyncio
+import aiohttp
+
+API_PATH = "/vision/v3.2/analyze"
+MIN_IMAGE_BYTES = 20 * 1024   # below this it's almost always a logo/icon
+
+
+def make_connector():
+    # pooled keep-alive connections to Azure: no TCP+TLS handshake per
+    # call, DNS answers cached for five minutes
+    return aiohttp.TCPConnector(limit=100, limit_per_host=20,
+                                ttl_dns_cache=300, keepalive_timeout=75)
+
+
+def make_session():
+    return aiohttp.ClientSession(connector=make_connector())
+
+
+async def head_size(session, url):
+    """Cheap HEAD probe: (Content-Length, Content-Type), (0, "") on failure."""
+    try:
+        async with session.head(url, allow_redirects=True,
+                                timeout=aiohttp.ClientTimeout(total=5)) as r:
+            return int(r.headers.get("Content-Length", 0)), r.headers.get("Content-Type", "")
+    except Exception:
+        return 0, ""
+
+
+async def pick_best_candidate(session, candidates):
+    """Pick the candidate worth a paid Vision call: parallel HEADs, largest
+    image-typed body wins, tiny files (icons/logos) are skipped. Falls back
+    to the first candidate when every probe fails or comes back tiny."""
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        return candidates[0]
+    probes = await asyncio.gather(*[head_size(session, u) for u in candidates])
+    best_url, best_size = None, 0
+    for url, (size, ctype) in zip(candidates, probes):
+        if "image" in ctype and size >= MIN_IMAGE_BYTES and size > best_size:
+            best_url, best_size = url, size
+    return best_url or candidates[0]
+
+
+async def analyze_url(session, endpoint, key, image_url, features, timeout=60):
+    """POST an image URL for analysis with the given visualFeatures string."""
+    api = endpoint.rstrip("/") + API_PATH
+    headers = {"Ocp-Apim-Subscription-Key": key, "Content-Type": "application/json"}
+    try:
+        async with session.post(api, headers=headers, params={"visualFeatures": features},
+                                json={"url": image_url},
+                                timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+            if r.status != 200:
+                return {"error": f"{r.status}"}
+            return await r.json()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def analyze_bytes(session, endpoint, key, image_bytes, features, timeout=60):
+    """Same as analyze_url but uploads raw image bytes (crop path)."""
+    api = endpoint.rstrip("/") + API_PATH
+    headers = {"Ocp-Apim-Subscription-Key": key, "Content-Type": "application/octet-stream"}
+    try:
+        async with session.post(api, headers=headers, params={"visualFeatures": features},
+                                data=image_bytes,
+                                timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+            if r.status != 200:
+                return {"error": f"{r.status}"}
+            return await r.json()
+    except Exception as e:
+        return {"error": str(e)}